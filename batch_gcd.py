@@ -0,0 +1,93 @@
+#Bernstein's batch GCD: for every number in a list, the gcd with the product
+#of all the others, in quasi-linear total time instead of N^2 gcd calls.
+#
+#A product tree multiplies neighbours level by level up to the product P of
+#everything. Walking back down, each node keeps P mod (node**2); at the
+#leaves z = P mod n**2, and gcd(z / n, n) is the gcd of n with the product
+#of the other numbers.
+import marshal
+import os
+import tempfile
+
+import euclidean
+
+class _LevelStore(object):
+	"""Stack of product tree levels, optionally spilled to files in a directory"""
+
+	def __init__(self, spill_dir = None):
+		self.spill_dir = spill_dir
+		self.levels = []
+
+	def push(self, level):
+		if self.spill_dir is None:
+			self.levels.append(level)
+			return
+		handle, path = tempfile.mkstemp(prefix = "level", dir = self.spill_dir)
+		with os.fdopen(handle, 'wb') as f:
+			marshal.dump(level, f)
+		self.levels.append(path)
+
+	def pop(self):
+		level = self.levels.pop()
+		if self.spill_dir is None:
+			return level
+		with open(level, 'rb') as f:
+			values = marshal.load(f)
+		os.remove(level)
+		return values
+
+	def __len__(self):
+		return len(self.levels)
+
+	def clear(self):
+		if self.spill_dir is not None:
+			for path in self.levels:
+				os.remove(path)
+		self.levels = []
+
+def _product_level(level):
+	#products of neighbouring pairs; an odd one out is carried up as is
+	products = [level[i] * level[i + 1] for i in xrange(0, len(level) - 1, 2)]
+	if len(level) % 2:
+		products.append(level[-1])
+	return products
+
+def batch_gcd(numbers, spill_dir = None):
+	"""
+	List of gcd(n, product of the other numbers) for each n in numbers.
+	With spill_dir set, every tree level except the one being worked on is
+	written to a file there, so memory stays around two levels' worth.
+	"""
+	level = list(numbers)
+	if any(n < 1 for n in level):
+		raise ValueError("batch_gcd needs positive integers")
+	if not level:
+		return []
+	store = _LevelStore(spill_dir)
+	try:
+		store.push(level)
+		while len(level) > 1:
+			level = _product_level(level)
+			store.push(level)
+		remainders = store.pop()
+		while len(store):
+			level = store.pop()
+			#the parent of node i is node i // 2 on the level above
+			remainders = [remainders[i // 2] % (n * n)
+					for i, n in enumerate(level)]
+	finally:
+		store.clear()
+	return [euclidean.euclidean_GCD(z // n, n)
+			for z, n in zip(remainders, level)]
+
+def main():
+
+	print batch_gcd([15, 13, 35, 22, 17017])
+	print batch_gcd([2 ** 61 - 1, 3 * (2 ** 61 - 1), 101 * 103, 103 * 107],
+			spill_dir = tempfile.gettempdir())
+
+
+
+
+if __name__ == '__main__':
+	main()
@@ -1,32 +1,109 @@
-def euclidean_GCD (a,b): 
-	r = max(a,b) - min(a,b)
-	if a == 0 and b == 0: 
-		return 0
-	elif a==0 or b == 0: 
-		print "No GCD for", a, b
+#GCD engine. Nothing here recurses, so the recursion limit never matters.
+#Machine-size inputs use the remainder loop; big ints use Lehmer's
+#algorithm, which runs most Euclid steps on the leading DIGIT_BITS bits
+#and only touches the full numbers once per batch of steps.
+
+#above this the inputs are treated as big ints
+MACHINE_INT = 1 << 63
+#bits of the leading digits Lehmer works on between full-size updates
+DIGIT_BITS = 62
+
+def _small_gcd(a, b):
+	#each step is one machine-size remainder
+	while b:
+		a, b = b, a % b
+	return a
+
+def _lehmer_step(a, b):
+	#cofactors (A, B, C, D) that advance a >= b by several Euclid steps
+	#using only their leading digits, or None if not even one step is safe
+	shift = max(a.bit_length() - DIGIT_BITS, 0)
+	x, y = a >> shift, b >> shift
+	A, B, C, D = 1, 0, 0, 1
+	while y + C != 0 and y + D != 0:
+		q = (x + A) // (y + C)
+		if q != (x + B) // (y + D):
+			break
+		A, B, x, C, D, y = C, D, y, A - q * C, B - q * D, x - q * y
+	if B == 0:
 		return None
-	elif min(a,b)%r ==0: 
-		return r
-	else: 
-		return euclidean_GCD(min(a,b), r)
+	return A, B, C, D
+
+def _lehmer_gcd(a, b):
+	#a >= b >= 0
+	while b >= MACHINE_INT:
+		step = _lehmer_step(a, b)
+		if step is None:
+			a, b = b, a % b
+		else:
+			A, B, C, D = step
+			a, b = A * a + B * b, C * a + D * b
+	return _small_gcd(a, b)
 
-def least_common_multiple(a,b): 
+def euclidean_GCD(a, b):
+	a, b = abs(a), abs(b)
+	if a < b:
+		a, b = b, a
+	if a < MACHINE_INT:
+		return _small_gcd(a, b)
+	return _lehmer_gcd(a, b)
+
+def extended_gcd(a, b):
+	#(g, x, y) with a*x + b*y == g == euclidean_GCD(a, b)
+	sign_a = -1 if a < 0 else 1
+	sign_b = -1 if b < 0 else 1
+	a, b = abs(a), abs(b)
+	swapped = a < b
+	if swapped:
+		a, b = b, a
+	#only the cofactor of the original a is tracked; the other one is
+	#recovered at the end from g = a*s + b*t
+	r0, r1, s0, s1 = a, b, 1, 0
+	while r1:
+		step = None
+		if r1 >= MACHINE_INT:
+			step = _lehmer_step(r0, r1)
+		if step is None:
+			q = r0 // r1
+			r0, r1 = r1, r0 - q * r1
+			s0, s1 = s1, s0 - q * s1
+		else:
+			A, B, C, D = step
+			r0, r1 = A * r0 + B * r1, C * r0 + D * r1
+			s0, s1 = A * s0 + B * s1, C * s0 + D * s1
+	t0 = (r0 - a * s0) // b if b else 0
+	if swapped:
+		s0, t0 = t0, s0
+	return r0, sign_a * s0, sign_b * t0
+
+def mod_inverse(a, m):
+	#x with a*x == 1 (mod m)
+	g, x, y = extended_gcd(a, m)
+	if g != 1:
+		raise ValueError("%d has no inverse modulo %d" % (a, m))
+	return x % m
+
+def least_common_multiple(a,b):
 	#Proposition: The least common multiple of a and b is the product of a,b divided by the GCD.
-	lcm = (a*b)/euclidean_GCD(a,b)
+	if a == 0 or b == 0:
+		return 0
+	lcm = abs(a // euclidean_GCD(a,b) * b)
 	return lcm
 
 
 
-def main(): 
+def main():
 
 	print euclidean_GCD(15, 13)
 	print euclidean_GCD(17017, 18900)
 	print euclidean_GCD(54, 42)
 	print euclidean_GCD(462,1071)
 	print least_common_multiple(462, 1071)
+	print extended_gcd(240, 46)
+	print mod_inverse(3, 11)
 
 
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,137 @@
+#Integer factorization. Numbers up to a bound are split with a table of
+#smallest prime factors; anything larger loses its small factors to trial
+#division and is then broken up with Pollard-Brent rho, using Miller-Rabin
+#to recognise when a piece is prime.
+import array
+import itertools
+
+import euclidean
+import primality
+import primes
+
+SPF_LIMIT = 10 ** 6
+
+def smallest_prime_factors(limit):
+	#array where entry n is the smallest prime factor of n, or 0 if n is
+	#prime (or 0 or 1). Larger primes are written first so the slices for
+	#smaller primes overwrite them.
+	spf = array.array('i', [0]) * (limit + 1)
+	for p in reversed(primes.generate_primes(primes._isqrt(limit))):
+		start = p * p
+		spf[start::p] = array.array('i', [p]) * ((limit - start) // p + 1)
+	return spf
+
+def _pollard_brent(n):
+	#a non-trivial factor of the odd composite n
+	gcd = euclidean.euclidean_GCD
+	batch = 128
+	for c in itertools.count(1):
+		y, r, q, g = 2, 1, 1, 1
+		while g == 1:
+			x = y
+			for i in xrange(r):
+				y = (y * y + c) % n
+			k = 0
+			while k < r and g == 1:
+				ys = y
+				for i in xrange(min(batch, r - k)):
+					y = (y * y + c) % n
+					q = q * abs(x - y) % n
+				g = gcd(q, n)
+				k += batch
+			r *= 2
+		if g == n:
+			#the batched product overshot, step back one value at a time
+			g = 1
+			while g == 1:
+				ys = (ys * ys + c) % n
+				g = gcd(abs(x - ys), n)
+		if g != n:
+			return g
+
+class Factorizer(object):
+	"""Factorizes integers, keeping a smallest-prime-factor table up to spf_limit"""
+
+	def __init__(self, spf_limit = SPF_LIMIT):
+		self.spf_limit = spf_limit
+		self.spf = smallest_prime_factors(spf_limit)
+
+	def _table_factors(self, n, factors):
+		spf = self.spf
+		while n > 1:
+			p = spf[n] or n
+			factors.append(p)
+			n //= p
+
+	def _large_factors(self, n, factors):
+		#n has no factor in primality.TRIAL_PRIMES
+		if n <= self.spf_limit:
+			self._table_factors(n, factors)
+		elif primality.is_prime(n):
+			factors.append(n)
+		else:
+			d = _pollard_brent(n)
+			self._large_factors(d, factors)
+			self._large_factors(n // d, factors)
+
+	def factorize(self, n):
+		#prime factors of n in increasing order, repeated by multiplicity
+		if n < 1:
+			raise ValueError("can only factorize positive integers, got %r" % n)
+		factors = []
+		if n <= self.spf_limit:
+			self._table_factors(n, factors)
+			return factors
+		for p in primality.TRIAL_PRIMES:
+			while n % p == 0:
+				factors.append(p)
+				n //= p
+		if n > 1:
+			self._large_factors(n, factors)
+		factors.sort()
+		return factors
+
+	def factorize_many(self, numbers):
+		#factorize every number in an iterable, returning a list of lists
+		spf = self.spf
+		limit = self.spf_limit
+		result = []
+		append = result.append
+		for n in numbers:
+			if 1 <= n <= limit:
+				factors = []
+				while n > 1:
+					p = spf[n] or n
+					factors.append(p)
+					n //= p
+				append(factors)
+			else:
+				append(self.factorize(n))
+		return result
+
+_DEFAULT = None
+
+def _default_factorizer():
+	global _DEFAULT
+	if _DEFAULT is None:
+		_DEFAULT = Factorizer()
+	return _DEFAULT
+
+def factorize(n):
+	return _default_factorizer().factorize(n)
+
+def factorize_many(numbers):
+	return _default_factorizer().factorize_many(numbers)
+
+def main():
+
+	print factorize(360)
+	print factorize(2 ** 64 + 1)
+	print factorize((2 ** 31 - 1) * (2 ** 61 - 1))
+	print factorize_many(range(1, 13))
+
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+#GCD and LCM over whole NumPy int64 arrays, for when euclidean_GCD would be
+#called in a Python loop over millions of pairs. Results are int64 too;
+#an LCM that does not fit raises OverflowError instead of wrapping.
+import numpy as np
+
+INT64_MAX = np.iinfo(np.int64).max
+INT64_MIN = np.iinfo(np.int64).min
+
+#reductions handle this many elements at a time, so an early exit skips
+#the rest of the array
+REDUCE_CHUNK = 1 << 16
+
+def _as_int64(values):
+	values = np.asarray(values)
+	if values.size and values.dtype.kind not in 'iu':
+		raise TypeError("expected an integer array, got %s" % values.dtype)
+	if values.size and values.dtype.kind == 'u' and values.max() > INT64_MAX:
+		raise OverflowError("values do not fit in int64")
+	values = values.astype(np.int64, copy = False)
+	if values.size and values.min() == INT64_MIN:
+		#its absolute value does not fit in int64
+		raise OverflowError("%d has no int64 absolute value" % INT64_MIN)
+	return values
+
+def _checked_lcm(a, b):
+	#elementwise lcm of non-negative int64 arrays
+	g = np.gcd(a, b)
+	nonzero = g != 0
+	q = a // np.where(nonzero, g, 1)
+	limit = INT64_MAX // np.where(b != 0, b, 1)
+	if (q > limit).any():
+		raise OverflowError("lcm does not fit in int64")
+	return np.where(nonzero, q * b, 0)
+
+def gcd(a, b):
+	#elementwise gcd, broadcasting like any NumPy ufunc
+	return np.gcd(_as_int64(a), _as_int64(b))
+
+def lcm(a, b):
+	#elementwise lcm; raises OverflowError if any result exceeds int64
+	return _checked_lcm(np.abs(_as_int64(a)), np.abs(_as_int64(b)))
+
+def _tree_reduce(values, combine):
+	#halves the array level by level, so each level is one array operation
+	while len(values) > 1:
+		half = len(values) // 2
+		values = np.concatenate((combine(values[:half], values[half:2 * half]),
+				values[2 * half:]))
+	return values
+
+def gcd_reduce(values):
+	#gcd of every element, stopping as soon as the running gcd is 1
+	values = np.abs(_as_int64(values)).ravel()
+	result = np.zeros(1, dtype = np.int64)
+	for start in xrange(0, len(values), REDUCE_CHUNK):
+		chunk = _tree_reduce(values[start:start + REDUCE_CHUNK], np.gcd)
+		result = np.gcd(result, chunk)
+		if result[0] == 1:
+			break
+	return int(result[0])
+
+def lcm_reduce(values):
+	#lcm of every element; 0 if any element is 0, OverflowError if too big
+	values = np.abs(_as_int64(values)).ravel()
+	if (values == 0).any():
+		return 0
+	result = np.ones(1, dtype = np.int64)
+	for start in xrange(0, len(values), REDUCE_CHUNK):
+		chunk = _tree_reduce(values[start:start + REDUCE_CHUNK], _checked_lcm)
+		result = _checked_lcm(result, chunk)
+	return int(result[0])
+
+def main():
+
+	print gcd([15, 17017, 54, 462], [13, 18900, 42, 1071])
+	print lcm([462, 4, 0], [1071, 6, 5])
+	print gcd_reduce([462, 1071, 21000])
+	print lcm_reduce(range(1, 21))
+
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,165 @@
+#Primality testing for numbers far beyond what a sieve can reach.
+#
+#Small factors are removed by trial division, numbers below 2**64 are then
+#settled by Miller-Rabin with a fixed set of bases that is known to have no
+#pseudoprimes in that range, and larger numbers get the Baillie-PSW test
+#(strong base 2 + strong Lucas), which has no known counterexample.
+import primes
+
+#trial division for single numbers stays short: most composites have a
+#factor below 256 and bail out on the first few divisions
+TRIAL_PRIMES = primes.generate_primes(256)
+#batches are pre-filtered by sieving the window they span with these
+SIEVE_PRIMES = primes.generate_primes(1 << 16)
+
+#Sinclair's bases: no strong pseudoprime below 2**64 passes all seven
+MILLER_RABIN_BASES = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+
+#a batch is sieved as one window when it has at least this many numbers
+#and they are packed no more sparsely than WINDOW_SPREAD apart on average
+WINDOW_MIN_BATCH = 256
+WINDOW_SPREAD = 64
+
+def _is_square(n):
+	root = primes._isqrt(n)
+	return root * root == n
+
+def _jacobi(a, n):
+	#Jacobi symbol (a/n) for odd n > 0
+	a %= n
+	result = 1
+	while a:
+		while a % 2 == 0:
+			a //= 2
+			if n % 8 in (3, 5):
+				result = -result
+		a, n = n, a
+		if a % 4 == 3 and n % 4 == 3:
+			result = -result
+		a %= n
+	return result if n == 1 else 0
+
+def _strong_probable_prime(n, base):
+	#Miller-Rabin round for odd n > 2
+	base %= n
+	if base == 0:
+		return True
+	d, s = n - 1, 0
+	while d % 2 == 0:
+		d //= 2
+		s += 1
+	x = pow(base, d, n)
+	if x == 1 or x == n - 1:
+		return True
+	for r in xrange(s - 1):
+		x = x * x % n
+		if x == n - 1:
+			return True
+	return False
+
+def _strong_lucas_probable_prime(n):
+	#strong Lucas test with Selfridge's parameters, for odd n > 2
+	if _is_square(n):
+		return False
+	D = 5
+	while True:
+		j = _jacobi(D, n)
+		if j == -1:
+			break
+		if j == 0 and abs(D) != n:
+			return False
+		D = -D - 2 if D > 0 else -D + 2
+	P, Q = 1, (1 - D) // 4
+	d, s = n + 1, 0
+	while d % 2 == 0:
+		d //= 2
+		s += 1
+	#walk the bits of d computing U_k, V_k and Q**k mod n
+	U, V, Qk = 1, P, Q % n
+	for bit in bin(d)[3:]:
+		U, V = U * V % n, (V * V - 2 * Qk) % n
+		Qk = Qk * Qk % n
+		if bit == '1':
+			U, V = P * U + V, D * U + P * V
+			#halve mod n; n is odd so adding n makes an odd value even
+			if U & 1:
+				U += n
+			if V & 1:
+				V += n
+			U, V = (U >> 1) % n, (V >> 1) % n
+			Qk = Qk * Q % n
+	if U == 0 or V == 0:
+		return True
+	for r in xrange(s - 1):
+		V = (V * V - 2 * Qk) % n
+		if V == 0:
+			return True
+		Qk = Qk * Qk % n
+	return False
+
+def _probable_prime(n):
+	#n is odd and has no factor in TRIAL_PRIMES
+	if n < 1 << 64:
+		return all(_strong_probable_prime(n, base)
+				for base in MILLER_RABIN_BASES)
+	return _strong_probable_prime(n, 2) and _strong_lucas_probable_prime(n)
+
+def is_prime(n):
+	if n < 2:
+		return False
+	for p in TRIAL_PRIMES:
+		if n % p == 0:
+			return n == p
+	if n < TRIAL_PRIMES[-1] ** 2:
+		return True
+	return _probable_prime(n)
+
+def _window_is_prime(values):
+	#sieves [min, max] of sorted distinct values with SIEVE_PRIMES, so a
+	#candidate only pays for Miller-Rabin if it has no factor below 2**16
+	result = {}
+	lo, hi = max(values[0], 3), values[-1]
+	base_primes = SIEVE_PRIMES
+	proven = SIEVE_PRIMES[-1] ** 2
+	position = 0
+	while position < len(values) and values[position] < lo:
+		result[values[position]] = values[position] == 2
+		position += 1
+	for low, count in primes._segment_bounds(lo, hi):
+		flags = primes._sieve_segment(low, count, base_primes)
+		high = low + 2 * count
+		while position < len(values) and values[position] < high:
+			n = values[position]
+			if n % 2 == 0 or not flags[(n - low) // 2]:
+				result[n] = False
+			else:
+				result[n] = n < proven or _probable_prime(n)
+			position += 1
+	return result
+
+def is_prime_many(numbers):
+	#primality of every number in an iterable, in order, as a list of bools
+	numbers = list(numbers)
+	values = sorted(set(numbers))
+	if (len(values) >= WINDOW_MIN_BATCH and
+			values[-1] - values[0] <= WINDOW_SPREAD * len(values)):
+		known = _window_is_prime(values)
+	else:
+		known = dict((n, is_prime(n)) for n in values)
+	return [known[n] for n in numbers]
+
+def main():
+
+	print is_prime(2 ** 61 - 1)
+	print is_prime(2 ** 127 - 1)
+	print is_prime(3215031751)
+	print is_prime_many(range(10 ** 12, 10 ** 12 + 100))
+	#large probable primes go through the Lucas test's square check
+	print is_prime(2 ** 255 - 19), is_prime(2 ** 255 - 21)
+	print is_prime(2 ** 2203 - 1), is_prime(2 ** 2203 + 1)
+
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,285 @@
+#Counting primes without listing them, by Lagarias, Miller and Odlyzko's
+#split of Meissel's formula
+#	pi(x) = phi(x, a) + a - 1 - sum over y < p <= sqrt(x) of (pi(x/p) - pi(p) + 1)
+#with y = x^(1/3) and a = pi(y), where phi(x, a) counts the numbers <= x
+#with no prime factor among the first a primes. phi(x, a) is unrolled into
+#ordinary leaves, read off a wheel, and special leaves phi(x/n, b - 1) with
+#n = p_b * m > y. A special leaf below p_b^2 is pi(x/n) - b + 2; the rest
+#are counted by one segmented sieve up to x^(2/3). Values of pi come from a
+#sieve table of primes up to about x^(2/3).
+import array
+import bisect
+
+import primes
+
+#phi(x, a) for a <= len(_WHEEL_PRIMES) repeats with period 2*3*5*7*11*13
+_WHEEL_PRIMES = (2, 3, 5, 7, 11, 13)
+_WHEEL_SIZE = 30030
+_WHEEL_TOTIENT = 5760
+
+#the small-prime table grows to x^(2/3) but not past this many numbers,
+#unless sqrt(x) itself is larger
+MAX_SIEVE_LIMIT = 10 ** 8
+
+#a remembered pi(x0) answers queries at most this far from x0 by sieving
+#the numbers in between
+MAX_MEMO_GAP = 10 ** 7
+
+def _wheel_tables():
+	#_WHEEL_PHI[a][r] = phi(r, a) for 0 <= r < _WHEEL_SIZE
+	tables = [range(_WHEEL_SIZE)]
+	flags = bytearray([1]) * _WHEEL_SIZE
+	flags[0] = 0
+	for p in _WHEEL_PRIMES:
+		flags[p::p] = bytearray(len(flags[p::p]))
+		flags[0] = 0
+		row = []
+		count = 0
+		for r in xrange(_WHEEL_SIZE):
+			count += flags[r]
+			row.append(count)
+		tables.append(row)
+	return tables
+
+_WHEEL_PHI = _wheel_tables()
+_WHEEL_PERIOD_PHI = [_WHEEL_SIZE, 15015, 10010, 8008, 6912, 6336, _WHEEL_TOTIENT]
+
+class PrimeCounter(object):
+	"""
+	Counts primes with the Lagarias-Miller-Odlyzko method, in time around
+	x^(2/3) and memory for the table of primes up to x^(2/3). The table is
+	kept between calls and, when memo is True, so are the values of pi
+	found: a query within MAX_MEMO_GAP of one of them only sieves the gap.
+	max_memo bounds the number of remembered values.
+	"""
+
+	def __init__(self, memo = True, max_memo = 10 ** 6):
+		self.memo = {} if memo else None
+		self.max_memo = max_memo
+		self._memo_points = [] #the keys of memo, sorted
+		self.sieve_limit = 0
+		self._primes = array.array('l')
+
+	def _ensure_sieve(self, limit):
+		if limit > self.sieve_limit:
+			self._primes.extend(primes.iter_primes_between(
+					self.sieve_limit + 1, limit))
+			self.sieve_limit = limit
+
+	def _small_pi(self, n):
+		return bisect.bisect_right(self._primes, n)
+
+	def phi(self, x, a):
+		#numbers in [1, x] not divisible by any of the first a primes
+		if a <= len(_WHEEL_PRIMES):
+			return ((x // _WHEEL_SIZE) * _WHEEL_PERIOD_PHI[a] +
+					_WHEEL_PHI[a][x % _WHEEL_SIZE])
+		if x < self._primes[a]:
+			#nothing in (1, x] survives: every candidate is below p_(a+1)
+			return 1 if x >= 1 else 0
+		if x <= self.sieve_limit and x < self._primes[a] ** 2:
+			#every survivor besides 1 is a prime above p_a
+			return self._small_pi(x) - a + 1
+		return self.phi(x, a - 1) - self.phi(x // self._primes[a - 1], a - 1)
+
+	def prime_count(self, x):
+		#pi(x): number of primes <= x
+		if x < 2:
+			return 0
+		self._ensure_sieve(max(min(int(round(x ** (2.0 / 3))), MAX_SIEVE_LIMIT),
+				primes._isqrt(x)))
+		if x <= self.sieve_limit:
+			return self._small_pi(x)
+		memo = self.memo
+		if memo is None:
+			return self._lmo_count(x)
+		nearest = self._nearest_memo(x)
+		if nearest is None:
+			result = self._lmo_count(x)
+		elif nearest < x:
+			result = memo[nearest] + self._count_between(nearest + 1, x)
+		else:
+			result = memo[nearest] - self._count_between(x + 1, nearest)
+		if x not in memo and len(memo) < self.max_memo:
+			memo[x] = result
+			bisect.insort(self._memo_points, x)
+		return result
+
+	def _nearest_memo(self, x):
+		#the remembered point closest to x, if within MAX_MEMO_GAP
+		points = self._memo_points
+		i = bisect.bisect_left(points, x)
+		close = [point for point in points[max(i - 1, 0):i + 1]
+				if abs(point - x) <= MAX_MEMO_GAP]
+		if not close:
+			return None
+		return min(close, key = lambda point: abs(point - x))
+
+	def _count_between(self, lo, hi):
+		#primes in [lo, hi], lo > 2, sieving the odd numbers with the table
+		count = 0
+		for low, n in primes._segment_bounds(lo, hi):
+			count += primes._sieve_segment(low, n, self._primes).count(b'\x01')
+		return count
+
+	def _lmo_count(self, x):
+		#pi(x) for x above the table, which reaches sqrt(x)
+		table = self._primes
+		y = _icbrt(x)
+		a = self._small_pi(y)
+		c = min(a, len(_WHEEL_PRIMES))
+		mu, least_factor = _mobius_table(y)
+		#ordinary leaves: squarefree n <= y with no factor among the wheel's
+		#first c primes
+		smallest = table[c - 1] if c else 1
+		total = 0
+		for n in xrange(1, y + 1):
+			if mu[n] and least_factor[n] > smallest:
+				total += mu[n] * self.phi(x // n, c)
+		#special leaves -mu(m) phi(x/(p_b m), b - 1) with m <= y < p_b m and
+		#every prime factor of m above p_b. Values of pi above the table
+		#wait in pending for one upward sieve pass.
+		hard = {}
+		pending = {}
+		for b in xrange(c + 1, a):
+			p = table[b - 1]
+			square = p * p
+			if square <= y:
+				ms = [m for m in xrange(y // p + 1, y + 1)
+						if mu[m] and least_factor[m] > p]
+			else:
+				#m <= y < p^2 leaves only the primes above p
+				ms = table[b:a]
+			leaves = []
+			for m in ms:
+				v = x // (p * m)
+				weight = -mu[m]
+				if v < square:
+					#every survivor besides 1 is a prime from p_b on
+					total += weight * (2 - b)
+					if v <= self.sieve_limit:
+						total += weight * self._small_pi(v)
+					else:
+						pending[v] = pending.get(v, 0) + weight
+				else:
+					leaves.append((v, weight))
+			if leaves:
+				leaves.reverse()
+				hard[b] = leaves
+		total += self._hard_leaves(hard)
+		#Meissel's correction for numbers with two prime factors above y
+		total += a - 1
+		for i in xrange(a + 1, self._small_pi(primes._isqrt(x)) + 1):
+			w = x // table[i - 1]
+			total += i - 1
+			if w <= self.sieve_limit:
+				total -= self._small_pi(w)
+			else:
+				pending[w] = pending.get(w, 0) - 1
+		large_pi = self._sieved_pi(sorted(pending))
+		for w, weight in pending.iteritems():
+			total += weight * large_pi[w]
+		return total
+
+	def _hard_leaves(self, hard):
+		#sum of weight * phi(v, b - 1) over hard[b], lists of (v, weight)
+		#sorted by v, from one segmented sieve of the odd numbers up to the
+		#largest v. Odd primes are crossed off from their squares, so
+		#p_2, ..., p_(b-1) themselves are still flagged and taken off again.
+		if not hard:
+			return 0
+		last_b = max(hard)
+		position = dict.fromkeys(hard, 0)
+		below = dict.fromkeys(hard, 0) #flags before the current segment
+		end = max(leaves[-1][0] for leaves in hard.itervalues())
+		total = 0
+		for low, n in primes._segment_bounds(1, end):
+			high = low + 2 * n
+			flags = bytearray([1]) * n
+			remaining = n #flags still set in the segment
+			for b in xrange(2, last_b + 1):
+				leaves = hard.get(b)
+				if leaves is not None and position[b] < len(leaves):
+					i = position[b]
+					seen = 0
+					counted = 0
+					while i < len(leaves) and leaves[i][0] < high:
+						v, weight = leaves[i]
+						index = (v - low) // 2 + 1
+						seen += flags.count(b'\x01', counted, index)
+						counted = index
+						total += weight * (below[b] + seen - (b - 2))
+						i += 1
+					position[b] = i
+					below[b] += remaining
+				p = self._primes[b - 1]
+				start = max(p * p, -(-low // p) * p)
+				if start % 2 == 0:
+					start += p
+				if start < high:
+					#only the multiples of p are counted, not the segment
+					index = (start - low) // 2
+					remaining -= flags[index::p].count(b'\x01')
+					flags[index::p] = bytearray((n - 1 - index) // p + 1)
+		return total
+
+	def _sieved_pi(self, points):
+		#pi(w) for sorted points above the table, counting primes segment by
+		#segment upward from sieve_limit
+		result = {}
+		if not points:
+			return result
+		count = len(self._primes)
+		position = 0
+		for low, n in primes._segment_bounds(self.sieve_limit + 1,
+				points[-1] + 1):
+			flags = primes._sieve_segment(low, n, self._primes)
+			high = low + 2 * n
+			while position < len(points) and points[position] < high:
+				w = points[position]
+				result[w] = count + flags[:(w - low) // 2 + 1].count(b'\x01')
+				position += 1
+			count += flags.count(b'\x01')
+		return result
+
+def _mobius_table(n):
+	#Moebius function and least prime factor of 0..n, with n + 1 standing
+	#for the least prime factor of 1
+	mu = [1] * (n + 1)
+	least_factor = [n + 1] * (n + 1)
+	for p in xrange(2, n + 1):
+		if least_factor[p] == n + 1:
+			for k in xrange(p, n + 1, p):
+				if least_factor[k] == n + 1:
+					least_factor[k] = p
+				mu[k] = -mu[k]
+			for k in xrange(p * p, n + 1, p * p):
+				mu[k] = 0
+	return mu, least_factor
+
+def _icbrt(n):
+	x = int(round(n ** (1.0 / 3)))
+	while x ** 3 > n:
+		x -= 1
+	while (x + 1) ** 3 <= n:
+		x += 1
+	return x
+
+def prime_count(x, counter = None):
+	#pi(x); pass a PrimeCounter to keep its tables and memo between calls
+	if counter is None:
+		counter = PrimeCounter()
+	return counter.prime_count(x)
+
+def main():
+
+	print prime_count(10 ** 6)
+	print prime_count(10 ** 9)
+	counter = PrimeCounter()
+	print [counter.prime_count(10 ** 10 + k) for k in (0, 1000, 2000)]
+
+
+
+
+if __name__ == '__main__':
+	main()
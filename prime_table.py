@@ -0,0 +1,182 @@
+#An on-disk prime table that is built once and then opened with mmap.
+#
+#Layout (all integers little endian):
+#	header: magic, limit, block size in bytes, bitmap bytes, block count
+#	index:  block count + 1 uint64 values, primes before each block
+#	bitmap: mod-30 wheel, one byte per 30 numbers, one bit per residue
+#
+#Every process that opens the same file shares the mapped pages, so workers
+#don't each need their own list of Python ints.
+import mmap
+import struct
+
+import primes
+
+MAGIC = b'PRIMETB1'
+HEADER = struct.Struct('<8sQQQQ')
+INDEX_ENTRY = struct.Struct('<Q')
+BLOCK_BYTES = 512
+
+#residues mod 30 that are coprime to 30; bit i of a byte is WHEEL[i]
+WHEEL = (1, 7, 11, 13, 17, 19, 23, 29)
+WHEEL_PRIMES = (2, 3, 5)
+_BIT = dict((residue, 1 << i) for i, residue in enumerate(WHEEL))
+#_AT_MOST[r] keeps the bits whose residue is <= r
+_AT_MOST = [sum(bit for residue, bit in _BIT.items() if residue <= r)
+		for r in range(30)]
+_POPCOUNT = bytes(bytearray(bin(i).count('1') for i in range(256)))
+_RESIDUES = [tuple(residue for residue in WHEEL if byte & _BIT[residue])
+		for byte in range(256)]
+
+def _popcount(data):
+	return sum(bytearray(data.translate(_POPCOUNT)))
+
+def build_prime_table(path, limit, workers = 1):
+	#sieve every prime up to limit into a table file at path
+	nbytes = limit // 30 + 1
+	nblocks = -(-nbytes // BLOCK_BYTES)
+	index = [0]
+	total = 0
+	with open(path, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, limit, BLOCK_BYTES, nbytes, nblocks))
+		f.write(b'\0' * (INDEX_ENTRY.size * (nblocks + 1)))
+		block = bytearray(BLOCK_BYTES)
+		block_start = 0 #first number covered by the current block
+		block_span = 30 * BLOCK_BYTES
+		for p in primes.iter_primes_between(7, limit, workers):
+			while p >= block_start + block_span:
+				f.write(block)
+				index.append(total)
+				block = bytearray(BLOCK_BYTES)
+				block_start += block_span
+			offset = p - block_start
+			block[offset // 30] |= _BIT[offset % 30]
+			total += 1
+		while len(index) <= nblocks:
+			used = min(BLOCK_BYTES, nbytes - (block_start // 30))
+			f.write(block[:used])
+			index.append(total)
+			block = bytearray(BLOCK_BYTES)
+			block_start += block_span
+		f.seek(HEADER.size)
+		f.write(b''.join(INDEX_ENTRY.pack(count) for count in index))
+
+class PrimeTable(object):
+	"""Read-only view of a table file written by build_prime_table"""
+
+	def __init__(self, path):
+		self._file = open(path, 'rb')
+		self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+		magic, self.limit, self.block_bytes, self.bitmap_bytes, self.blocks = \
+				HEADER.unpack_from(self._map, 0)
+		if magic != MAGIC:
+			self.close()
+			raise ValueError("%s is not a prime table" % path)
+		self._index_offset = HEADER.size
+		self._bitmap_offset = (self._index_offset +
+				INDEX_ENTRY.size * (self.blocks + 1))
+		small_primes = len([p for p in WHEEL_PRIMES if p <= self.limit])
+		self.total = small_primes + self._primes_before_block(self.blocks)
+
+	def close(self):
+		self._map.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def _check_range(self, n):
+		if n > self.limit:
+			raise ValueError("%d is beyond the table limit %d" % (n, self.limit))
+
+	def _primes_before_block(self, block):
+		return INDEX_ENTRY.unpack_from(self._map,
+				self._index_offset + INDEX_ENTRY.size * block)[0]
+
+	def _byte(self, i):
+		return struct.unpack_from('B', self._map, self._bitmap_offset + i)[0]
+
+	def _bytes(self, start, end):
+		return self._map[self._bitmap_offset + start:self._bitmap_offset + end]
+
+	def is_prime(self, n):
+		if n < 7:
+			return n in WHEEL_PRIMES
+		self._check_range(n)
+		bit = _BIT.get(n % 30)
+		return bit is not None and bool(self._byte(n // 30) & bit)
+
+	def prime_count(self, x):
+		#pi(x): number of primes <= x
+		if x < 7:
+			return len([p for p in WHEEL_PRIMES if p <= x])
+		self._check_range(x)
+		i = x // 30
+		block = i // self.block_bytes
+		return (len(WHEEL_PRIMES) + self._primes_before_block(block) +
+				_popcount(self._bytes(block * self.block_bytes, i)) +
+				bin(self._byte(i) & _AT_MOST[x % 30]).count('1'))
+
+	def nth_prime(self, k):
+		#nth_prime(1) == 2
+		if k < 1 or k > self.total:
+			raise ValueError("table holds %d primes, asked for #%d" %
+					(self.total, k))
+		if k <= len(WHEEL_PRIMES):
+			return WHEEL_PRIMES[k - 1]
+		k -= len(WHEEL_PRIMES)
+		#binary search for the last block with fewer than k primes before it
+		lo, hi = 0, self.blocks - 1
+		while lo < hi:
+			mid = (lo + hi + 1) // 2
+			if self._primes_before_block(mid) < k:
+				lo = mid
+			else:
+				hi = mid - 1
+		k -= self._primes_before_block(lo)
+		i = lo * self.block_bytes
+		for byte in bytearray(self._bytes(i, i + self.block_bytes)):
+			count = len(_RESIDUES[byte])
+			if k <= count:
+				return 30 * i + _RESIDUES[byte][k - 1]
+			k -= count
+			i += 1
+		raise ValueError("corrupt prime table index")
+
+	def iter_primes(self, lo = 2, hi = None):
+		#primes in [lo, hi], read straight out of the bitmap
+		if hi is None:
+			hi = self.limit
+		self._check_range(hi)
+		for p in WHEEL_PRIMES:
+			if lo <= p <= hi:
+				yield p
+		i = max(lo, 7) // 30
+		last = hi // 30
+		while i <= last:
+			end = min(i + self.block_bytes, last + 1)
+			for byte in bytearray(self._bytes(i, end)):
+				base = 30 * i
+				for residue in _RESIDUES[byte]:
+					p = base + residue
+					if lo <= p <= hi:
+						yield p
+				i += 1
+
+def main():
+
+	build_prime_table("primes.table", 10 ** 6)
+	with PrimeTable("primes.table") as table:
+		print table.prime_count(10 ** 6)
+		print table.nth_prime(1000)
+		print table.is_prime(999983)
+		print list(table.iter_primes(100, 150))
+
+
+
+
+if __name__ == '__main__':
+	main()
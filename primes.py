@@ -1,17 +1,181 @@
 #write a func to print all prime nums up to and including the input parameter
+import array
+import itertools
+import multiprocessing
 
-def generate_primes(num): 
-	primes = [2,3]
-	for i in range (3, num+1):
-		num_is_prime = True
-		for item in primes: 
-			if i % item == 0:
-				num_is_prime = False
+#Segmented Sieve of Eratosthenes over odd numbers only.
+#Each segment is a bytearray with one flag per odd number; 2**18 flags is
+#256KB, which stays inside a typical L2 cache while the segment is crossed off.
+SEGMENT_SIZE = 1 << 18
 
-		if num_is_prime == True:
-			primes.append(i)
+#next_prime sieves below this and runs primality.is_prime above it
+NEXT_PRIME_SIEVE_LIMIT = 10 ** 6
 
-	return primes
+def _isqrt(n):
+	#exact integer square root by Newton's method, for longs of any size.
+	#The start 2**ceil(bits/2) is above the root, and from there every
+	#step decreases until the root is reached.
+	if n < 2:
+		return n
+	x = 1 << ((n.bit_length() + 1) // 2)
+	while True:
+		y = (x + n // x) // 2
+		if y >= x:
+			return x
+		x = y
+
+def _small_primes(limit):
+	#plain odd-only sieve, used for the base primes up to sqrt(n)
+	if limit < 2:
+		return []
+	if limit < 3:
+		return [2]
+	size = (limit + 1) // 2 #flag i stands for 2*i + 1
+	flags = bytearray([1]) * size
+	flags[0] = 0 #1 is not prime
+	for i in xrange(1, (_isqrt(limit) - 1) // 2 + 1):
+		if flags[i]:
+			p = 2 * i + 1
+			start = (p * p - 1) // 2
+			flags[start::p] = bytearray((size - 1 - start) // p + 1)
+	return [2] + list(itertools.compress(xrange(1, limit + 1, 2), flags))
+
+def _sieve_segment(low, count, base_primes):
+	#flags for the odd numbers low, low+2, ..., low+2*(count-1); low is odd
+	flags = bytearray([1]) * count
+	high = low + 2 * count
+	for p in base_primes:
+		if p == 2:
+			continue
+		square = p * p
+		if square >= high:
+			break
+		if square >= low:
+			start = square
+		else:
+			#first odd multiple of p that is >= low
+			start = -(-low // p) * p
+			if start % 2 == 0:
+				start += p
+		index = (start - low) // 2
+		flags[index::p] = bytearray((count - 1 - index) // p + 1)
+	if low == 1:
+		flags[0] = 0
+	return flags
+
+def _segment_bounds(lo, hi, segment_size = SEGMENT_SIZE):
+	#(low, count) for each segment covering the odd numbers in [lo, hi]
+	low = lo | 1
+	while low <= hi:
+		count = min(segment_size, (hi - low) // 2 + 1)
+		yield low, count
+		low += 2 * count
+
+def _segment_primes(low, flags):
+	return itertools.compress(xrange(low, low + 2 * len(flags), 2), flags)
+
+#Worker side of the process pool. The base primes are handed over once by
+#the pool initializer instead of being pickled with every segment.
+_BASE_PRIMES = None
+
+def _init_worker(base_primes):
+	global _BASE_PRIMES
+	_BASE_PRIMES = base_primes
+
+def _sieve_task(bounds, base_primes = None):
+	if base_primes is None:
+		base_primes = _BASE_PRIMES
+	low, count = bounds
+	return low, _sieve_segment(low, count, base_primes)
+
+def _count_task(bounds, base_primes = None):
+	low, flags = _sieve_task(bounds, base_primes)
+	return flags.count(b'\x01')
+
+def _map_segments(func, lo, hi, workers, segment_size, ordered = True):
+	#runs func over every segment of [lo, hi], in a pool if workers > 1
+	base_primes = _small_primes(_isqrt(hi))
+	bounds = _segment_bounds(lo, hi, segment_size)
+	if workers <= 1:
+		for segment in bounds:
+			yield func(segment, base_primes)
+		return
+	pool = multiprocessing.Pool(workers, _init_worker, (base_primes,))
+	try:
+		if ordered:
+			results = pool.imap(func, bounds)
+		else:
+			results = pool.imap_unordered(func, bounds)
+		for result in results:
+			yield result
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+def iter_primes_between(lo, hi, workers = 1, segment_size = SEGMENT_SIZE):
+	#streams the primes in [lo, hi] in increasing order. With workers > 1
+	#segments are sieved in a process pool and yielded as they come back.
+	lo = max(lo, 2)
+	if hi < lo:
+		return
+	if lo == 2:
+		yield 2
+	for low, flags in _map_segments(_sieve_task, lo, hi, workers,
+			segment_size):
+		for p in _segment_primes(low, flags):
+			yield p
+
+def count_primes_between(lo, hi, workers = 1, segment_size = SEGMENT_SIZE):
+	#number of primes in [lo, hi]; workers > 1 counts segments in parallel
+	lo = max(lo, 2)
+	if hi < lo:
+		return 0
+	total = 1 if lo == 2 else 0
+	return total + sum(_map_segments(_count_task, lo, hi, workers,
+			segment_size, ordered = False))
+
+def primes_between(lo, hi, workers = 1):
+	#all primes p with lo <= p <= hi, sieving only the window itself
+	return list(iter_primes_between(lo, hi, workers))
+
+def generate_primes(num, workers = 1):
+	return primes_between(2, num, workers)
+
+def iter_primes(start = 2, segment_size = SEGMENT_SIZE):
+	#yields every prime >= start, forever, sieving one segment at a time.
+	#Segments start small so the first prime comes back almost immediately
+	#and double up to segment_size; only base primes up to sqrt of the
+	#current segment are kept.
+	if start <= 2:
+		yield 2
+	low = max(start, 3) | 1
+	base_primes = array.array('l')
+	base_limit = 1
+	count = 64
+	while True:
+		count = min(count * 2, segment_size)
+		limit = _isqrt(low + 2 * count)
+		if limit > base_limit:
+			#extend the base primes in one go, leaving room to grow
+			new_limit = max(limit, 2 * base_limit)
+			base_primes.extend(iter_primes_between(base_limit + 1, new_limit))
+			base_limit = new_limit
+		for p in _segment_primes(low, _sieve_segment(low, count, base_primes)):
+			yield p
+		low += 2 * count
+
+def next_prime(n):
+	#smallest prime strictly greater than n. Past NEXT_PRIME_SIEVE_LIMIT
+	#the base primes up to sqrt(n) would cost more than testing candidates.
+	if n < NEXT_PRIME_SIEVE_LIMIT:
+		return next(iter_primes(n + 1))
+	#imported here because primality imports this module
+	import primality
+	candidate = (n + 1) | 1
+	while not primality.is_prime(candidate):
+		candidate += 2
+	return candidate
 
 def main():
 
@@ -0,0 +1,218 @@
+import array
+import bisect
+import math
+import random
+import sys
+
+'''
+Arrival processes: iterators of arrival times in increasing order, pulled
+one at a time by the simulation, so memory does not grow with the number
+of customers. They are classes rather than generator functions so that a
+checkpointed simulation can pickle the process mid-stream. Each random
+process draws from rng, a random.Random, or from the random module's own
+generator if rng is None (a module can't be pickled, so it isn't stored).
+'''
+
+class ArrivalProcess(object):
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        raise NotImplementedError
+
+    __next__ = next
+
+class SequenceArrivals(ArrivalProcess):
+    """Arrival times that are already in a list or array"""
+
+    def __init__(self, times):
+        self.times = times
+        self.position = 0
+
+    def next(self):
+        if (self.position >= len(self.times)):
+            raise StopIteration
+        self.position += 1
+        return self.times[self.position - 1]
+
+def asArrivalProcess(arrivals):
+    if isinstance(arrivals, ArrivalProcess):
+        return arrivals
+    return SequenceArrivals(arrivals)
+
+class PoissonArrivals(ArrivalProcess):
+    """
+    Exponential gaps at rate per unit of time, the first customer arriving
+    at time 0. With rounded, gaps are whole ticks as the tick simulation
+    needs. count limits the number of arrivals, otherwise it never ends.
+    """
+
+    def __init__(self, rate, count = None, rounded = True, rng = None):
+        self.rate = rate
+        self.count = count
+        self.rounded = rounded
+        self.rng = rng
+        self.arrived = 0
+        self.time = 0
+
+    def next(self):
+        if ((self.count is not None) and (self.arrived >= self.count)):
+            raise StopIteration
+        gap = (self.rng or random).expovariate(self.rate)
+        if self.rounded:
+            gap = round(gap)
+        #the first gap is drawn and dropped, so the first customer arrives at 0
+        if (self.arrived > 0):
+            self.time += gap
+        self.arrived += 1
+        return self.time
+
+class RateCurve(object):
+    """
+    Piecewise constant arrival rate over a repeating period, e.g. a day:
+    points is [(start time, rate), ...] with the first start at 0.
+    """
+
+    def __init__(self, points, period):
+        self.starts = [start for start, rate in points]
+        self.rates = [rate for start, rate in points]
+        self.period = period
+
+    def __call__(self, time):
+        offset = time % self.period
+        return self.rates[bisect.bisect_right(self.starts, offset) - 1]
+
+    def maximum(self):
+        return max(self.rates)
+
+class NonHomogeneousPoissonArrivals(ArrivalProcess):
+    """
+    Poisson arrivals whose rate changes with time, by Lewis and Shedler's
+    thinning: candidates come at maxRate and each is kept with probability
+    rateFunction(t) / maxRate. rateFunction is usually a RateCurve; it has
+    to be picklable for checkpoints. Stops after count arrivals or past
+    endTime, whichever is given.
+    """
+
+    def __init__(self, rateFunction, maxRate = None, count = None,
+            endTime = None, rounded = False, rng = None):
+        self.rateFunction = rateFunction
+        if maxRate is None:
+            maxRate = rateFunction.maximum()
+        self.maxRate = maxRate
+        self.count = count
+        self.endTime = endTime
+        self.rounded = rounded
+        self.rng = rng
+        self.arrived = 0
+        self.time = 0.0
+
+    def next(self):
+        if ((self.count is not None) and (self.arrived >= self.count)):
+            raise StopIteration
+        rng = self.rng or random
+        while True:
+            self.time += rng.expovariate(self.maxRate)
+            if ((self.endTime is not None) and (self.time > self.endTime)):
+                raise StopIteration
+            if (rng.random() * self.maxRate <= self.rateFunction(self.time)):
+                break
+        self.arrived += 1
+        if self.rounded:
+            #rounding can't go backwards, times stay in order
+            return round(self.time)
+        return self.time
+
+class BatchArrivals(ArrivalProcess):
+    """
+    Groups of customers arriving together at the times of another arrival
+    process. Every group has batchSize customers, or with geometric, a
+    geometrically distributed size with mean batchSize.
+    """
+
+    def __init__(self, epochs, batchSize = 2, geometric = False, rng = None):
+        self.epochs = epochs
+        self.batchSize = batchSize
+        self.geometric = geometric
+        self.rng = rng
+        self.left = 0 #customers still to come at time
+        self.time = None
+
+    def drawBatchSize(self):
+        if not self.geometric:
+            return self.batchSize
+        if (self.batchSize <= 1):
+            return 1
+        #failures before the first success, plus one
+        success = 1.0 / self.batchSize
+        return 1 + int(math.log(1.0 - (self.rng or random).random()) /
+                math.log(1.0 - success))
+
+    def next(self):
+        if (self.left == 0):
+            self.time = next(self.epochs)
+            self.left = self.drawBatchSize()
+        self.left -= 1
+        return self.time
+
+class TraceArrivals(ArrivalProcess):
+    """
+    Replays recorded arrival times from a file, read chunkSize values at a
+    time: little-endian float64s if the name ends in .bin, otherwise text
+    with one time per line. Only the position in the file is pickled.
+    """
+
+    def __init__(self, path, chunkSize = 1 << 16):
+        self.path = path
+        self.chunkSize = chunkSize
+        self.binary = path.endswith(".bin")
+        self.offset = 0 #bytes of the file consumed
+        self.traceFile = None
+        self.chunk = []
+        self.position = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["offset"] = self.offset - self.unread()
+        state["traceFile"] = None
+        state["chunk"] = []
+        state["position"] = 0
+        return state
+
+    def unread(self):
+        #bytes read from the file that are still waiting in the chunk
+        if self.binary:
+            return (len(self.chunk) - self.position) * 8
+        return sum(len(line) for line in self.chunk[self.position:])
+
+    def readChunk(self):
+        if self.traceFile is None:
+            self.traceFile = open(self.path, "rb")
+            self.traceFile.seek(self.offset)
+        if self.binary:
+            data = self.traceFile.read(self.chunkSize * 8)
+            self.chunk = array.array('d')
+            self.chunk.fromstring(data)
+            if (sys.byteorder == "big"):
+                self.chunk.byteswap()
+            self.offset += len(data)
+        else:
+            self.chunk = self.traceFile.readlines(self.chunkSize * 16)
+            self.offset += sum(len(line) for line in self.chunk)
+        self.position = 0
+
+    def next(self):
+        while True:
+            if (self.position >= len(self.chunk)):
+                self.readChunk()
+                if not self.chunk:
+                    self.traceFile.close()
+                    self.traceFile = None
+                    raise StopIteration
+            value = self.chunk[self.position]
+            self.position += 1
+            if self.binary:
+                return value
+            if value.strip():
+                return float(value)
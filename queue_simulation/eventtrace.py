@@ -0,0 +1,132 @@
+import struct
+import json
+import sys
+import collections
+
+'''
+Binary trace of what happens to every customer, in place of text logging.
+Each event is one fixed size record (time, event type, customer ID,
+station ID) packed into a preallocated buffer. With a file, a full buffer
+is written out in one go; without one, the buffer is a ring that keeps the
+most recent records. readTrace and queueLengthTimelines turn a trace back
+into per-station waiting line and server occupancy over time.
+'''
+
+RECORD = struct.Struct("<dBqi")
+
+#Event types. For ARRIVE and EXIT the station field holds the shop's ID.
+ARRIVE, JOIN_LINE, START_SERVICE, RELEASE, SKIP, EXIT = range(6)
+EVENT_NAMES = ["arrive", "join line", "start service", "release", "skip",
+        "exit"]
+
+class TraceRecorder(object):
+
+    def __init__(self, path = None, capacity = 1 << 16):
+        self.path = path
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.used = 0 #records in the buffer
+        self.wrapped = False #ring mode has overwritten old records
+        self.names = {"stations": {}, "shops": {}}
+        self.traceFile = open(path, "wb") if path else None
+
+    def describe(self, kind, identifier, name):
+        #kept next to the trace so the reader can print names, not IDs
+        self.names[kind][str(identifier)] = name
+
+    def record(self, time, event, customerID, stationID):
+        if (self.used == self.capacity):
+            if self.traceFile is None:
+                self.used = 0
+                self.wrapped = True
+            else:
+                self.flush()
+        RECORD.pack_into(self.buffer, self.used * RECORD.size, time, event,
+                customerID, stationID)
+        self.used += 1
+
+    def flush(self):
+        if self.traceFile is not None:
+            self.traceFile.write(buffer(self.buffer, 0,
+                self.used * RECORD.size))
+            self.used = 0
+
+    def records(self):
+        #what is still in memory, oldest first
+        end = self.used * RECORD.size
+        if self.wrapped:
+            data = self.buffer[end:] + self.buffer[:end]
+        else:
+            data = self.buffer[:end]
+        return [RECORD.unpack_from(data, offset)
+                for offset in xrange(0, len(data), RECORD.size)]
+
+    def close(self):
+        if self.traceFile is not None:
+            self.flush()
+            self.traceFile.close()
+            self.traceFile = None
+            with open(self.path + ".json", "w") as namesFile:
+                json.dump(self.names, namesFile)
+
+def readTrace(path, chunkRecords = 1 << 16):
+    #yield (time, event, customerID, stationID), reading a chunk at a time
+    with open(path, "rb") as traceFile:
+        while True:
+            data = traceFile.read(chunkRecords * RECORD.size)
+            if not data:
+                return
+            for offset in xrange(0, len(data) - RECORD.size + 1, RECORD.size):
+                yield RECORD.unpack_from(data, offset)
+
+def readNames(path):
+    try:
+        with open(path + ".json") as namesFile:
+            return json.load(namesFile)
+    except IOError:
+        return {"stations": {}, "shops": {}}
+
+def queueLengthTimelines(records):
+    """
+    {stationID: [(time, waiting, being served), ...]} with one entry per
+    change, rebuilt from trace records in the order they were written.
+    """
+    waiting = collections.defaultdict(int)
+    served = collections.defaultdict(int)
+    inLine = set() #(customerID, stationID)
+    timelines = collections.defaultdict(list)
+    for time, event, customerID, stationID in records:
+        if (event == JOIN_LINE):
+            inLine.add((customerID, stationID))
+            waiting[stationID] += 1
+        elif (event == START_SERVICE):
+            if ((customerID, stationID) in inLine):
+                inLine.remove((customerID, stationID))
+                waiting[stationID] -= 1
+            served[stationID] += 1
+        elif (event == RELEASE):
+            served[stationID] -= 1
+        else:
+            continue
+        timelines[stationID].append((time, waiting[stationID],
+            served[stationID]))
+    return timelines
+
+def main():
+    #summarize the waiting lines in a trace file
+    path = sys.argv[1]
+    names = readNames(path)
+    timelines = queueLengthTimelines(readTrace(path))
+    for stationID in sorted(timelines):
+        timeline = timelines[stationID]
+        area = sum(waiting * (nextTime - time) for (time, waiting, served),
+                (nextTime, _, _) in zip(timeline, timeline[1:]))
+        duration = timeline[-1][0] - timeline[0][0]
+        print "Station %s: %s" % (stationID,
+                names["stations"].get(str(stationID), ""))
+        print "    Changes: %d" % len(timeline)
+        print "    Max Waiting Line: %d" % max(entry[1] for entry in timeline)
+        print "    Mean Waiting Line: %f" % (area / duration if duration else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import collections
+import imp
+import json
+import os
+import sys
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+'''
+Memoized queues-theory metrics behind a small local HTTP/JSON endpoint, so
+planning tools share warm results instead of re-running the formulas.
+
+    POST /query  {"arrivalRate": 0.25, "serviceRate": 0.5,
+                  "numberOfServers": 1, "N": 5}
+                 or a list of such objects for a batch
+    GET /stats   cache hits, misses, evictions and size
+'''
+
+queuesTheory = imp.load_source("queuesTheory", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "queues-theory.py"))
+
+#Significant digits rates are rounded to, so that 0.1 + 0.2 and 0.3 share
+#an entry
+KEY_DIGITS = 12
+DEFAULT_PORT = 8765
+
+class MetricsCache(object):
+    """
+    At most maxEntries results, dropping the least recently used first, and
+    optionally expiring them timeToLive seconds after they were computed.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxEntries = 4096, timeToLive = None):
+        self.maxEntries = maxEntries
+        self.timeToLive = timeToLive
+        self.entries = collections.OrderedDict() #key: (time stored, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        #the cached value for key, calling compute() on a miss
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if ((entry is not None) and (self.timeToLive is not None) and
+                    (time.time() - entry[0] > self.timeToLive)):
+                entry = None
+            if entry is not None:
+                #back to the most recently used end
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            while (len(self.entries) > self.maxEntries):
+                self.entries.popitem(last = False)
+                self.evictions += 1
+        return value
+
+    def getStats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": len(self.entries),
+                    "maxEntries": self.maxEntries,
+                    "timeToLive": self.timeToLive}
+
+def normalizeQuery(query):
+    #(arrivalRate, serviceRate, numberOfServers, N) with rates rounded
+    if not isinstance(query, dict):
+        raise TypeError("a query must be a JSON object, not %s" %
+                json.dumps(query))
+    rate = lambda name: float("%.*g" % (KEY_DIGITS, float(query[name])))
+    N = query.get("N")
+    return (rate("arrivalRate"), rate("serviceRate"),
+            int(query.get("numberOfServers", 1)),
+            None if N is None else int(N))
+
+def computeMetrics(key):
+    arrivalRate, serviceRate, numberOfServers, N = key
+    station = queuesTheory.WorkStation(arrivalRate, serviceRate,
+            numberOfServers)
+    if (station.utilisation >= 1.0):
+        raise ValueError("arrivals outpace the servers, the queue grows "
+                "without bound")
+    metrics = {
+        "utilisation": station.utilisation,
+        "timeWaiting": station.computeTimeWaiting(),
+        "timeInSystem": station.computeTimeInSystem(),
+        "customersWaitingToBeServed":
+            station.computeNumberOfCustomersWaitingToBeServed(),
+        }
+    if N is not None:
+        metrics["probabilityOfNJobsInTheSystem"] = \
+                station.computeProbabilityOfNJobsInTheSystem(N)
+    return metrics
+
+class MetricsService(object):
+
+    def __init__(self, cache = None):
+        self.cache = cache or MetricsCache()
+
+    def query(self, query):
+        #metrics for one query dict; bad or unstable queries get an "error"
+        try:
+            key = normalizeQuery(query)
+            return self.cache.get(key, lambda: computeMetrics(key))
+        except (KeyError, TypeError, ValueError, ZeroDivisionError,
+                AssertionError) as e:
+            return {"error": "%s: %s" % (e.__class__.__name__, e)}
+
+    def queryBatch(self, queries):
+        if isinstance(queries, list):
+            return [self.query(query) for query in queries]
+        return self.query(queries)
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def sendJSON(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if (self.path == "/stats"):
+            self.sendJSON(200, self.server.service.cache.getStats())
+        else:
+            self.sendJSON(404, {"error": "unknown path %s" % self.path})
+
+    def do_POST(self):
+        if (self.path != "/query"):
+            self.sendJSON(404, {"error": "unknown path %s" % self.path})
+            return
+        length = int(self.headers.getheader("Content-Length", 0))
+        try:
+            queries = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.sendJSON(400, {"error": "bad JSON: %s" % e})
+            return
+        if not isinstance(queries, (dict, list)):
+            self.sendJSON(400, {"error": "expected a query object or a list "
+                "of them"})
+            return
+        self.sendJSON(200, self.server.service.queryBatch(queries))
+
+    def log_message(self, format, *args):
+        #no line on stderr for every request
+        pass
+
+def makeServer(port = DEFAULT_PORT, service = None):
+    #only listens on this machine
+    server = ThreadedHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    server.service = service or MetricsService()
+    return server
+
+def main():
+    port = int(sys.argv[1]) if (len(sys.argv) > 1) else DEFAULT_PORT
+    server = makeServer(port)
+    print "Serving queueing metrics on http://127.0.0.1:%d" % port
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
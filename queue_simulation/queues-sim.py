@@ -1,24 +1,158 @@
 import random
 import math
+import array
 import pprint
 from operator import attrgetter
 import logging
+import heapq
+import itertools
+import collections
+import multiprocessing
+import os
+import sys
+import json
+import hashlib
+import copy
+import cPickle as pickle
+import copy_reg
+import types
+import zlib
+
+import streamstats
+import eventtrace
+import arrivals
 
 '''Source: https://gist.githubusercontent.com/gbigwood/5304126/raw/fa64a8299e653bcbc5d056d9d49f2a16ec6a310f/queues-theory.py'''
 
 logging.basicConfig(filename="queues-sim.log", level=logging.INFO, 
         filemode="w")
 
+#Per customer events go to this eventtrace.TraceRecorder, see startTracing.
+#When it is None the hot paths only pay for the check.
+TRACER = None
+
+class Router(object):
+    """Picks which of a stage's parallel stations a customer joins.
+    Subclasses that keep an index get told whenever a line changes."""
+
+    def __init__(self, stations):
+        self.stations = stations
+        for position, station in enumerate(stations):
+            station.router = self
+            station.routerPosition = position
+
+    def choose(self):
+        raise NotImplementedError
+
+    def queueLengthChanged(self, station):
+        pass
+
+class ShortestQueueRouter(Router):
+    """Join the station with the fewest customers, waiting or being served,
+    ties going to the earliest station. Stations sit in a heap keyed on
+    (queue length, position) that is fixed up whenever a queue grows or
+    shrinks, so both cost O(log k)."""
+
+    def __init__(self, stations):
+        Router.__init__(self, stations)
+        self.heap = range(len(stations)) #station positions
+        self.where = range(len(stations)) #heap index of each position
+        for i in reversed(xrange(len(self.heap) // 2)):
+            self.siftDown(i)
+
+    def key(self, position):
+        return (self.stations[position].queueLength(), position)
+
+    def swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.where[heap[i]] = i
+        self.where[heap[j]] = j
+
+    def siftUp(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.key(self.heap[i]) >= self.key(self.heap[parent]):
+                break
+            self.swap(i, parent)
+            i = parent
+
+    def siftDown(self, i):
+        size = len(self.heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if ((child < size) and (self.key(self.heap[child]) <
+                        self.key(self.heap[smallest]))):
+                    smallest = child
+            if smallest == i:
+                break
+            self.swap(i, smallest)
+            i = smallest
+
+    def choose(self):
+        return self.stations[self.heap[0]]
+
+    def queueLengthChanged(self, station):
+        i = self.where[station.routerPosition]
+        self.siftUp(i)
+        self.siftDown(self.where[station.routerPosition])
+
+class PowerOfTwoChoicesRouter(Router):
+    """Sample two stations at random and join the shorter queue"""
+
+    def choose(self):
+        if (len(self.stations) == 1):
+            return self.stations[0]
+        first, second = random.sample(self.stations, 2)
+        if (second.queueLength() < first.queueLength()):
+            return second
+        return first
+
+class RoundRobinRouter(Router):
+    """Send customers to each station in turn"""
+
+    def __init__(self, stations):
+        Router.__init__(self, stations)
+        self.nextPosition = 0
+
+    def choose(self):
+        station = self.stations[self.nextPosition]
+        self.nextPosition = (self.nextPosition + 1) % len(self.stations)
+        return station
+
+class RandomRouter(Router):
+    """Send each customer to a station picked uniformly at random"""
+
+    def choose(self):
+        return random.choice(self.stations)
+
 class Shop(object):
 
-    def __init__(self, shopName, workStations):
+    NUMBER_OF_SHOPS = 0
+
+    def __init__(self, shopName, workStations,
+            routingPolicy = ShortestQueueRouter):
         self.shopName = shopName
+        self.shopID = Shop.NUMBER_OF_SHOPS
+        Shop.NUMBER_OF_SHOPS += 1
         #A matrix of stations. [[station], [station,station],[station]]
         self.stations = workStations
+        #One router per stage, choosing between its parallel stations
+        self.routers = [routingPolicy(station) for station in self.stations]
 
         self.total_number_of_customers = 0
         self.total_time_spent_waiting = 0
         self.total_time_spent_being_served = 0
+        #Customers in the shop; stations pass around their slot numbers
+        self.customers = CustomerStore()
+        #Per customer totals over everyone who has left, and the number of
+        #customers in the shop over time
+        self.waitingStats = streamstats.DistributionStats()
+        self.timeInSystemStats = streamstats.DistributionStats()
+        self.customersInShopStats = streamstats.TimeWeightedStats()
+        #Waiting time series for warm-up detection, see runAdaptiveSimulation
+        self.steadyStateMonitor = None
         #set up workstation index. Shows where in the pipeline they are.
         index = 0
         for station in self.stations:
@@ -27,11 +161,19 @@ class Shop(object):
                 substation.parentShop = self
             index += 1
 
-    def addCustomer(self, customer, arrivalTime):
-        logging.debug("Adding customer %d at %d",
-                customer.customerID, arrivalTime)
-        self.moveCustomerToNextStation(-1, customer, arrivalTime)
-        pass
+    def attachCalendar(self, calendar, continuousTime = True):
+        #run this shop's stations off an event calendar instead of ticks
+        for station in self.stations:
+            for substation in station:
+                substation.attachCalendar(calendar, continuousTime)
+
+    def addCustomer(self, arrivalTime, currentTime):
+        customer = self.customers.add(arrivalTime)
+        self.customersInShopStats.update(currentTime, len(self.customers))
+        if TRACER is not None:
+            TRACER.record(currentTime, eventtrace.ARRIVE,
+                    self.customers.customerID[customer], self.shopID)
+        self.moveCustomerToNextStation(-1, customer, currentTime)
 
     def moveCustomerToNextStation(self, currentStationIndex,
             customer, currentTime):
@@ -43,17 +185,25 @@ class Shop(object):
 
         if (stationIndex == len(self.stations)):
             #customer has finished being served by the shop, they can leave
-            customer.exitTime = currentTime
             self.total_number_of_customers += 1
-            self.total_time_spent_waiting += customer.getWaitingTime()
-            self.total_time_spent_being_served += customer.getServiceTime()
-            logging.debug("Customer %d exiting shop %s at time %d", 
-                    customer.customerID, self.shopName, currentTime)
+            self.total_time_spent_waiting += \
+                    self.customers.timeSpentWaiting[customer]
+            self.total_time_spent_being_served += \
+                    self.customers.timeSpentBeingServed[customer]
+            self.waitingStats.add(self.customers.timeSpentWaiting[customer])
+            if self.steadyStateMonitor is not None:
+                self.steadyStateMonitor.add(
+                        self.customers.timeSpentWaiting[customer])
+            self.timeInSystemStats.add(currentTime -
+                    self.customers.arrivalTime[customer])
+            if TRACER is not None:
+                TRACER.record(currentTime, eventtrace.EXIT,
+                        self.customers.customerID[customer], self.shopID)
+            self.customers.remove(customer)
+            self.customersInShopStats.update(currentTime, len(self.customers))
         else:
             #Find which of the potential stations to use:
-            nextStation = min(self.stations[stationIndex])#smallest queue
-            logging.debug("Customer %d moving to station %s at time %d",
-                    customer.customerID, nextStation.description, currentTime)
+            nextStation = self.routers[stationIndex].choose()
             nextStation.addCustomer(customer, currentTime)
 
     def tickOfTime(self, currentTickNumber):
@@ -62,6 +212,13 @@ class Shop(object):
                 #make each station see if it is finished with any customers
                 subStation.tickOfTime(currentTickNumber)
 
+    def closeStats(self, endTime):
+        #count the levels at the end of the run up to endTime
+        self.customersInShopStats.close(endTime)
+        for station in self.stations:
+            for substation in station:
+                substation.waitingLineStats.close(endTime)
+
     def areCustomersInStore(self):
         for station in self.stations:
             for substation in station:
@@ -94,59 +251,90 @@ class Shop(object):
     Mean Average Waiting Time: %f
     Mean Average Service Time: %f
     Proportion of Time Wasted: %f
-    Customers Served: %d""" % (self.shopName,
+    Customers Served: %d
+    Waiting Time Std Dev: %f
+    95th/99th Percentile Waiting Time: %f / %f
+    95th/99th Percentile Time In Shop: %f / %f
+    Mean/Max Customers In Shop: %f / %d""" % (self.shopName,
             self.getMeanAverageWaitingTime(),
             self.getMeanAverageServiceTime(),
             self.getMeanAverageWaitingTime() / (
                 self.getMeanAverageWaitingTime() +
                 self.getMeanAverageServiceTime()),
-            self.total_number_of_customers
+            self.total_number_of_customers,
+            self.waitingStats.standardDeviation(),
+            self.waitingStats.quantile(0.95),
+            self.waitingStats.quantile(0.99),
+            self.timeInSystemStats.quantile(0.95),
+            self.timeInSystemStats.quantile(0.99),
+            self.customersInShopStats.mean(),
+            self.customersInShopStats.maximum
             )
 
-class Customer(object):
-    NUMBER_OF_CUSTOMERS = 0
+    def getStationStats(self):
+        return "".join(subStation.getStats() for station in self.stations
+                for subStation in station)
 
-    def __init__(self, arrivalTime):
-        self.customerID = Customer.NUMBER_OF_CUSTOMERS
-        Customer.NUMBER_OF_CUSTOMERS +=1
+    def getStreamingStats(self):
+        #everything above as plain dicts, see mergeStreamingStats
+        return {
+            "waitingTime": self.waitingStats.toDict(),
+            "timeInSystem": self.timeInSystemStats.toDict(),
+            "customersInShop": self.customersInShopStats.toDict(),
+            "stations": [[subStation.description,
+                subStation.waitingStats.toDict(),
+                subStation.waitingLineStats.toDict()]
+                for station in self.stations for subStation in station],
+            }
+
+class CustomerStore(object):
+    """
+    The customers currently in one shop, held as parallel typed arrays and
+    referred to everywhere else by their slot number. A slot is reused once
+    its customer leaves, so memory follows the number of customers in the
+    shop rather than the number that have ever arrived.
+    """
+    NUMBER_OF_CUSTOMERS = 0
 
+    def __init__(self, capacity = 64):
+        #unique across all shops, unlike slots
+        self.customerID = array.array('l')
         #When they arrived at the shop
-        self.arrivalTime = arrivalTime
-        #When they left the shop
-        self.exitTime = None
+        self.arrivalTime = array.array('d')
         #Time spent Waiting
-        self.timeSpentWaiting = 0.0
+        self.timeSpentWaiting = array.array('d')
         #Time spent Being Served
-        self.timeSpentBeingServed = 0.0
+        self.timeSpentBeingServed = array.array('d')
+        #When they joined the line they are currently in
+        self.enteredLineAt = array.array('d')
+        self.freeSlots = array.array('l')
+        self.grow(capacity)
 
-    def increaseWaitingTime(self):
-        self.timeSpentWaiting += 1.0
+    def grow(self, extra):
+        start = len(self.customerID)
+        for column in (self.customerID, self.arrivalTime,
+                self.timeSpentWaiting, self.timeSpentBeingServed,
+                self.enteredLineAt):
+            column.extend(itertools.repeat(0, extra))
+        self.freeSlots.extend(reversed(xrange(start, start + extra)))
 
-    def increaseServingTime(self):
-        self.timeSpentBeingServed += 1.0
+    def add(self, arrivalTime):
+        if not self.freeSlots:
+            self.grow(len(self.customerID))
+        slot = self.freeSlots.pop()
+        self.customerID[slot] = CustomerStore.NUMBER_OF_CUSTOMERS
+        CustomerStore.NUMBER_OF_CUSTOMERS += 1
+        self.arrivalTime[slot] = arrivalTime
+        self.timeSpentWaiting[slot] = 0.0
+        self.timeSpentBeingServed[slot] = 0.0
+        self.enteredLineAt[slot] = 0.0
+        return slot
 
-    def computeTimeInSystem(self):
-        if (self.exitTime == None):
-            return self.arrivalTime + \
-                    self.timeSpentWaiting + \
-                    self.timeSpentBeingServed
-        return self.exitTime - self.arrivalTime
+    def remove(self, slot):
+        self.freeSlots.append(slot)
 
-    def getWaitingTime(self):
-        return self.timeSpentWaiting
-
-    def __repr__(self):
-        return "<Customer ID: " + str(self.customerID) + " arrivalTime " + \
-                str(self.arrivalTime) + \
-                " timespentWaiting: " + str(self.timeSpentWaiting) + \
-                " timespentBeingServed: " + str(self.timeSpentBeingServed) + \
-                " >"
-
-    def getArrivalTime(self):
-        return self.arrivalTime
-
-    def getServiceTime(self):
-        return self.timeSpentBeingServed
+    def __len__(self):
+        return len(self.customerID) - len(self.freeSlots)
 
 class WorkStation(object):
 
@@ -157,31 +345,95 @@ class WorkStation(object):
 
         self.numberOfServers = numberOfServers
         self.index = None #where in its parents list of stations is it?
+        self.router = None #picks between this station and its siblings
+        self.routerPosition = None
         self.stationID = WorkStation.NUMBER_OF_STATIONS
         WorkStation.NUMBER_OF_STATIONS += 1
         self.description = description #what does this station do?
 
-        self.currentWaitingCustomers = []
-        self.currentServedCustomers = [] #should equal number of servers
+        self.currentWaitingCustomers = collections.deque()
+        self.currentServedCustomers = set() #at most number of servers
+        #min-heap of (releaseTime, sequence, customer) for the tick loop
         self.releaseCurrentCustomerAt = []
+        self.releaseSequence = 0 #breaks ties between equal release times
 
         self.serviceRate = serviceRate
         self.probabilityOfUse = probabilityOfUse
 
+        #Waiting time of each customer served here, and waiting line length
+        self.waitingStats = streamstats.DistributionStats()
+        self.waitingLineStats = streamstats.TimeWeightedStats()
+
+        #Set when the station is driven by an EventCalendar
+        self.calendar = None
+        self.continuousTime = False
+
+    def attachCalendar(self, calendar, continuousTime = True):
+        self.calendar = calendar
+        self.continuousTime = continuousTime
+
+    def queueLength(self):
+        return (len(self.currentWaitingCustomers) +
+                len(self.currentServedCustomers))
+
     def areCustomersAtStation(self):
         if ((len(self.currentWaitingCustomers) > 0) or
                 (len(self.currentServedCustomers) > 0)):
             return True
         return False
 
+    def drawServiceTime(self):
+        serviceTime = random.expovariate(self.serviceRate)
+        if self.continuousTime:
+            return serviceTime
+        return round(math.ceil(serviceTime))
+
     def startServingCustomer(self, customer, currentTickNumber):
         assert len(self.currentServedCustomers) < self.numberOfServers
-        self.currentServedCustomers.append(customer)
-        serviceTime = round(math.ceil(random.expovariate(self.serviceRate)))
+        self.currentServedCustomers.add(customer)
+        self.router.queueLengthChanged(self)
+        serviceTime = self.drawServiceTime()
         releaseTime = currentTickNumber + serviceTime
-        self.releaseCurrentCustomerAt.append(releaseTime)
-        logging.debug("Station %s going to release Customer %s at time %d",
-                self.description, customer.customerID, releaseTime)
+        #the whole service time is known up front, nothing to count per tick
+        self.parentShop.customers.timeSpentBeingServed[customer] += serviceTime
+        if TRACER is not None:
+            TRACER.record(currentTickNumber, eventtrace.START_SERVICE,
+                    self.parentShop.customers.customerID[customer],
+                    self.stationID)
+        if self.calendar is None:
+            self.releaseSequence += 1
+            heapq.heappush(self.releaseCurrentCustomerAt,
+                    (releaseTime, self.releaseSequence, customer))
+        else:
+            self.calendar.schedule(releaseTime, self.releaseCustomer, customer)
+
+    def finishServingCustomer(self, customer, currentTime):
+        self.currentServedCustomers.remove(customer)
+        self.router.queueLengthChanged(self)
+        if TRACER is not None:
+            TRACER.record(currentTime, eventtrace.RELEASE,
+                    self.parentShop.customers.customerID[customer],
+                    self.stationID)
+        self.parentShop.moveCustomerToNextStation(self.index, customer,
+                currentTime)
+
+    def serveNextInLine(self, currentTime):
+        #waiting time is settled once, when the customer leaves the line
+        customers = self.parentShop.customers
+        nextInLine = self.currentWaitingCustomers.popleft()
+        self.waitingLineStats.update(currentTime,
+                len(self.currentWaitingCustomers))
+        waitingTime = currentTime - customers.enteredLineAt[nextInLine]
+        customers.timeSpentWaiting[nextInLine] += waitingTime
+        self.waitingStats.add(waitingTime)
+        self.startServingCustomer(nextInLine, currentTime)
+
+    def releaseCustomer(self, customer):
+        #service completion event: pass the customer on, take the next in line
+        currentTime = self.calendar.currentTime
+        self.finishServingCustomer(customer, currentTime)
+        if (len(self.currentWaitingCustomers) > 0):
+            self.serveNextInLine(currentTime)
 
     def __repr__(self):
         return self.description + str(self.index) + \
@@ -189,53 +441,40 @@ class WorkStation(object):
 
     def addCustomer(self, customer, currentTickNumber):
         if (random.random() > self.probabilityOfUse):
-            logging.debug("Customer %d skipping station %s at time %d",
-                    customer.customerID, self.description, currentTickNumber)
+            if TRACER is not None:
+                TRACER.record(currentTickNumber, eventtrace.SKIP,
+                        self.parentShop.customers.customerID[customer],
+                        self.stationID)
             self.parentShop.moveCustomerToNextStation(self.index, customer,
                     currentTickNumber)
             return
         if (len(self.currentServedCustomers) >= self.numberOfServers):
-            logging.debug("Customer %d added to waiting line at " +
-                    "station %s at time %d",
-                    customer.customerID, self.description, currentTickNumber)
+            if TRACER is not None:
+                TRACER.record(currentTickNumber, eventtrace.JOIN_LINE,
+                        self.parentShop.customers.customerID[customer],
+                        self.stationID)
+            self.parentShop.customers.enteredLineAt[customer] = \
+                    currentTickNumber
             self.currentWaitingCustomers.append(customer)
+            self.waitingLineStats.update(currentTickNumber,
+                    len(self.currentWaitingCustomers))
+            self.router.queueLengthChanged(self)
         else:
+            self.waitingStats.add(0)
             self.startServingCustomer(customer, currentTickNumber)
 
-    def __cmp__(self, other):
-        return cmp(len(self.currentWaitingCustomers),
-                len(other.currentWaitingCustomers))
-
     def tickOfTime(self, currentTickNumber):
-        #If they are done, move to next station
-        toRemove = [ (releaseTime, self.currentServedCustomers[index]) for
-                index, releaseTime in enumerate(self.releaseCurrentCustomerAt)
-                if (releaseTime == currentTickNumber)]
-        for releaseTime, customer in toRemove:
-            self.releaseCurrentCustomerAt.remove(releaseTime)
-            self.currentServedCustomers.remove(customer)
-            logging.debug("Customer %d released by station %s at time %d",
-                    customer.customerID,
-                    self.description,
-                    currentTickNumber)
-            self.parentShop.moveCustomerToNextStation(self.index, customer,
-                    currentTickNumber)
-
-        #increaseServiceTime for customers still being served
-        for customer in self.currentServedCustomers:
-            customer.increaseServingTime()
-
-        #Those in line have waited, increase time waited
-        for customer in self.currentWaitingCustomers:
-            customer.increaseWaitingTime()
+        #If they are done, move to next station. Only customers whose
+        #release time has come are touched.
+        releases = self.releaseCurrentCustomerAt
+        while (releases and (releases[0][0] <= currentTickNumber)):
+            releaseTime, sequence, customer = heapq.heappop(releases)
+            self.finishServingCustomer(customer, currentTickNumber)
 
         #Fill up available servers:
         freeServers = self.numberOfServers - len(self.currentServedCustomers)
-        logging.debug("freeServer ID: %d desc: %s freeServers: %d",
-                self.stationID, self.description, freeServers)
         while ((freeServers > 0) and (len(self.currentWaitingCustomers) > 0) ):
-            nextInLine = self.currentWaitingCustomers.pop(0)
-            self.startServingCustomer(nextInLine, currentTickNumber)
+            self.serveNextInLine(currentTickNumber)
             freeServers -= 1
 
     def getQueueStrings(self):
@@ -243,187 +482,720 @@ class WorkStation(object):
                 len(self.currentWaitingCustomers),
                 len(self.currentServedCustomers))
 
-'''
-#Chipotle example
-chipotleStations = [
-        [WorkStation(serviceRate = 1/5.0,
-            description="burrito/bowl/tacos")],
-        [WorkStation(serviceRate = 1/7.0,
-            description="rice+meat")],
-        [WorkStation(serviceRate = 1/12.0,
-            description="salsa+salad")],
-        [WorkStation(serviceRate = 1/9.0,
-            description="wrapping+pricing")],
-        [WorkStation(serviceRate = 1.0/10.0,
-            description="paying")],
-        ]
-
-#Subway:
-subwayStations = [
-        [WorkStation(serviceRate = 1/8.0,
-            description="What kind of bread? + slice")],
-        [WorkStation(serviceRate = 1/17.0,
-            description="Meat + cheese")],
-        [WorkStation(serviceRate = 1/32.0,
-            probabilityOfUse = 0.8, description="Toaster",
-            numberOfServers=1.0)],
-        [WorkStation(serviceRate = 1/17.0,
-            description="Salad + dressing")],
-        [WorkStation(serviceRate = 1/15.0,
-            description="Paying + wrapping")],
-        ]
-subwayStationsb = [
-        [WorkStation(serviceRate = 1/8.0,
-            description="What kind of bread? + slice")],
-        [WorkStation(serviceRate = 1/17.0,
-            description="Meat + cheese")],
-        [WorkStation(serviceRate = 1/32.0,
-            probabilityOfUse = 0.8, description="Toaster",
-            numberOfServers=2.0)],
-        [WorkStation(serviceRate = 1/17.0,
-            description="Salad + dressing")],
-        [WorkStation(serviceRate = 1/15.0,
-            description="Paying + wrapping")],
-        ]
-subwayStationsc = [
-        [WorkStation(serviceRate = 1/8.0,
-            description="What kind of bread? + slice")],
-        [WorkStation(serviceRate = 1/17.0,
-            description="Meat + cheese")],
-        [WorkStation(serviceRate = 1/32.0,
-            probabilityOfUse = 0.8, description="Toaster",
-            numberOfServers=100.0)],
-        [WorkStation(serviceRate = 1/17.0,
-            description="Salad + dressing")],
-        [WorkStation(serviceRate = 1/15.0,
-            description="Paying + wrapping")],
-        ]
-
-#Starbucks
-starbucksStations = [
-        [WorkStation(serviceRate = 1/22.0,
-            numberOfServers = 1.0, description="order + Paying ")],
-        [WorkStation(serviceRate = 1/92.0,
-            numberOfServers = 3.0, description="making coffee")],
-        ]
-
-#McDonalds
-mcDonaldsStations = [
-        [
-            WorkStation(serviceRate = 1/42.0 , description = "order and pay"),
-            WorkStation(serviceRate = 1/42.0 , description = "order and pay"),
-            WorkStation(serviceRate = 1/42.0 , description = "order and pay"),
-            WorkStation(serviceRate = 1/42.0 , description = "order and pay"),
-            WorkStation(serviceRate = 1/42.0 , description = "order and pay"),
-            ],
-        [WorkStation( serviceRate = 1/102.0,
-            numberOfServers = 5.0, description="food is made")],
-        ]
-
-#Chopt
-choptStations = [
-        [WorkStation(serviceRate = 1/4.0,
-            numberOfServers = 1.0, description="Wait for placement")],
-        [
-            WorkStation(serviceRate = 1/32.0,
-                numberOfServers = 1.0, description = "collect ingredients"),
-            WorkStation(serviceRate = 1/32.0,
-                numberOfServers = 1.0, description = "collect ingredients"),
-            WorkStation(serviceRate = 1/32.0,
-                numberOfServers = 1.0, description = "collect ingredients"),
-            WorkStation(serviceRate = 1/32.0,
-                numberOfServers = 1.0, description = "collect ingredients"),
-            ],
-        [
-            WorkStation(serviceRate = 1/47.0,
-                numberOfServers = 1.0, description="Chop ingredients"),
-            WorkStation(serviceRate = 1/47.0,
-                numberOfServers = 1.0, description="Chop ingredients"),
-            WorkStation(serviceRate = 1/47.0,
-                numberOfServers = 1.0, description="Chop ingredients"),
-            WorkStation(serviceRate = 1/47.0,
-                numberOfServers = 1.0, description="Chop ingredients"),
-            WorkStation(serviceRate = 1/47.0,
-                numberOfServers = 1.0, description="Chop ingredients"),
-            WorkStation(serviceRate = 1/47.0,
-                numberOfServers = 1.0, description="Chop ingredients"),
-            ],
-        [WorkStation(serviceRate = 1/17.0,
-            numberOfServers = 3.0, description="paying + wrapping")],
-        ]
-
-SHOPS = [
-        Shop("Chipotle", chipotleStations),
-        Shop("Subway", subwayStations),
-        Shop("Subway: two toasters", subwayStationsb),
-        Shop("Subway: 100 toasters", subwayStationsc),
-        Shop("Starbucks", starbucksStations),
-        Shop("McDonalds", mcDonaldsStations),
-        Shop("Chopt", choptStations)
-        ]
-'''
+    def getStats(self):
+        return """
+        Station: %s
+        Mean/95th Percentile Waiting Time: %f / %f
+        Mean/Max Waiting Line: %f / %d""" % (self.description,
+                self.waitingStats.mean(), self.waitingStats.quantile(0.95),
+                self.waitingLineStats.mean(), self.waitingLineStats.maximum)
+
+class EventCalendar(object):
+    """Pending events ordered by time. Events at the same time run in the
+    order they were scheduled."""
+
+    def __init__(self):
+        self.events = []
+        self.sequence = 0
+        self.currentTime = 0
+        #time of the last event not scheduled as background
+        self.lastEventTime = 0
+
+    def schedule(self, time, action, *args):
+        self.sequence += 1
+        heapq.heappush(self.events, (time, self.sequence, action, args, False))
+
+    def scheduleBackground(self, time, action, *args):
+        #an event, such as a progress report, that doesn't count towards
+        #lastEventTime
+        self.sequence += 1
+        heapq.heappush(self.events, (time, self.sequence, action, args, True))
+
+    def run(self, stopTime):
+        #jump from event to event until none are left or they pass stopTime
+        while self.events and self.events[0][0] <= stopTime:
+            time, sequence, action, args, background = \
+                    heapq.heappop(self.events)
+            self.currentTime = time
+            if not background:
+                self.lastEventTime = time
+            action(*args)
+        return self.lastEventTime
+
+#Shops and their stations are described in this file, see buildShop
+SHOPS_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        "shops.json")
+
+def loadShopConfigs(path = SHOPS_CONFIG):
+    with open(path) as configFile:
+        return json.load(configFile)["shops"]
+
+def buildStation(stationConfig):
+    #stationConfig holds WorkStation arguments, with meanServiceTime
+    #allowed in place of serviceRate
+    settings = dict(stationConfig)
+    settings.pop("copies", None)
+    if ("meanServiceTime" in settings):
+        settings["serviceRate"] = 1.0 / settings.pop("meanServiceTime")
+    return WorkStation(**settings)
+
+def buildShop(shopConfig):
+    #{"name": ..., "stages": [[station, ...], ...]}; a station with
+    #"copies": n stands for n identical parallel stations in its stage
+    stations = [[buildStation(station) for station in stage
+            for copy in xrange(station.get("copies", 1))]
+            for stage in shopConfig["stages"]]
+    return Shop(shopConfig["name"], stations)
+
+def buildShops(path = SHOPS_CONFIG):
+    return [buildShop(shopConfig) for shopConfig in loadShopConfigs(path)]
+
 #Simulate customers and when they arrive.
 AVERAGE_ARRIVAL_RATE = 1.0/5.0
 NUMBER_OF_CUSTOMERS_TO_SIMULATE = 10000
 ABORT_SIMULATION_TIME = 500000
 MAX_ACCEPTABLE_QUEUE_LENGTH = 360
+#Ticks (or simulated seconds) between progress reports in the log
+REPORT_INTERVAL = 1000
+
+def poissonArrivals(numberOfCustomers, arrivalRate = AVERAGE_ARRIVAL_RATE):
+    #numberOfCustomers - 1 arrivals, drawn one at a time from their own
+    #stream seeded from the random module, so the customers don't depend on
+    #how many service times the shops draw
+    return arrivals.PoissonArrivals(arrivalRate, numberOfCustomers - 1,
+            rng = random.Random(random.getrandbits(64)))
+
+def customerArrives(shops, arrivalTime, currentTime):
+    #Customer goes to the shops!
+    for shop in shops:
+        #We try go to all the shops!
+        if (shop.getMeanAverageWaitingTime() < MAX_ACCEPTABLE_QUEUE_LENGTH):
+            shop.addCustomer(arrivalTime, currentTime)
+        else:
+            logging.info("Line too long at %s. AverageWaitingTime: %d " +
+                    "current time %d ",
+                    shop.shopName, shop.getMeanAverageWaitingTime(),
+                    currentTime)
+
+def logProgress(shops, currentTime):
+    logging.info("TickNumber %d ", currentTime)
+    for shop in shops:
+        logging.info("Shop Stats %s", shop.getStats())
+
+def startTracing(shops, path = None, capacity = 1 << 16):
+    #record every customer event of these shops; with no path only the
+    #last capacity events are kept, in memory
+    global TRACER
+    TRACER = eventtrace.TraceRecorder(path, capacity)
+    for shop in shops:
+        TRACER.describe("shops", shop.shopID, shop.shopName)
+        for station in shop.stations:
+            for subStation in station:
+                TRACER.describe("stations", subStation.stationID,
+                        "%s: %s" % (shop.shopName, subStation.description))
+    return TRACER
+
+def stopTracing():
+    global TRACER
+    if TRACER is not None:
+        TRACER.close()
+    TRACER = None
+
+def runTickSimulation(shops, arrivalTimes):
+    #Advance one tick at a time, asking every station about every tick.
+    #arrivalTimes is a list or an arrivals.ArrivalProcess, pulled lazily.
+    arrivalProcess = arrivals.asArrivalProcess(arrivalTimes)
+    nextArrival = next(arrivalProcess, None)
+    currentTick = 0
+
+    while True:
+        #TODO refactor into several functions
+        if ((currentTick  % REPORT_INTERVAL) == 0):
+            logProgress(shops, currentTick)
+
+        if ((currentTick == ABORT_SIMULATION_TIME) or
+                ((nextArrival is None) and \
+                        not(any(shop.areCustomersInStore() for shop in shops)))):
+            #simulation over, nobody left to arrive, no customers in any store
+            break
+
+        #arrivals between ticks are let in at the next tick
+        while ((nextArrival is not None) and (nextArrival <= currentTick)):
+            customerArrives(shops, nextArrival, currentTick)
+            nextArrival = next(arrivalProcess, None)
+
+        for shop in shops:
+            shop.tickOfTime(currentTick)
+        #no more of the same arrival time.
+        currentTick += 1
+
+    for shop in shops:
+        shop.closeStats(currentTick)
+    return currentTick
+
+class EventSimulation(object):
+    """
+    Shops driven by one EventCalendar, jumping straight from one arrival or
+    service completion to the next, so the work done depends on the number
+    of events, not on simulated time. Everything the run depends on lives
+    in this object, so it can be saved with saveCheckpoint part way through
+    and carried on later.
+    """
+
+    def __init__(self, shops, arrivalTimes, continuousTime = True):
+        self.shops = shops
+        self.calendar = EventCalendar()
+        for shop in shops:
+            shop.attachCalendar(self.calendar, continuousTime)
+        #a list or an arrivals.ArrivalProcess, pulled one arrival at a time
+        self.arrivals = arrivals.asArrivalProcess(arrivalTimes)
+        self.scheduleNextArrival()
+        self.calendar.scheduleBackground(0, self.report)
+
+    def scheduleNextArrival(self):
+        #only the next arrival sits in the calendar at any time
+        arrivalTime = next(self.arrivals, None)
+        if arrivalTime is not None:
+            self.calendar.schedule(arrivalTime, self.arrive, arrivalTime)
+
+    def arrive(self, arrivalTime):
+        customerArrives(self.shops, arrivalTime, arrivalTime)
+        self.scheduleNextArrival()
+
+    def report(self):
+        logProgress(self.shops, self.calendar.currentTime)
+        if self.calendar.events:
+            self.calendar.scheduleBackground(
+                    self.calendar.currentTime + REPORT_INTERVAL, self.report)
+
+    def isFinished(self, stopTime):
+        events = self.calendar.events
+        return (not events) or (events[0][0] > stopTime)
+
+    def run(self, stopTime = None, checkpointPath = None,
+            checkpointInterval = None):
+        #run up to stopTime (default ABORT_SIMULATION_TIME), saving a
+        #checkpoint to checkpointPath every checkpointInterval of simulated
+        #time, or once at stopTime without an interval; returns the time
+        #of the last event other than a progress report
+        if stopTime is None:
+            stopTime = ABORT_SIMULATION_TIME
+        if checkpointPath is None:
+            self.calendar.run(stopTime)
+        elif checkpointInterval is None:
+            self.calendar.run(stopTime)
+            saveCheckpoint(self, checkpointPath)
+        else:
+            sliceEnd = self.calendar.currentTime
+            while not self.isFinished(stopTime):
+                sliceEnd = min(sliceEnd + checkpointInterval, stopTime)
+                self.calendar.run(sliceEnd)
+                saveCheckpoint(self, checkpointPath)
+        return self.calendar.lastEventTime
+
+    def finish(self):
+        #close the time weighted statistics at the last event
+        endTime = self.calendar.lastEventTime
+        for shop in self.shops:
+            shop.closeStats(endTime)
+        return endTime
+
+def runEventSimulation(shops, arrivalTimes, continuousTime = True):
+    simulation = EventSimulation(shops, arrivalTimes, continuousTime)
+    simulation.run()
+    return simulation.finish()
+
+#Calendar events are bound methods, which pickle can't save by itself
+def _reduceMethod(method):
+    return getattr, (method.im_self, method.im_func.__name__)
+
+copy_reg.pickle(types.MethodType, _reduceMethod)
+
+def saveCheckpoint(simulation, path):
+    """
+    Write everything needed to carry on simulation exactly where it is:
+    the simulation itself (shops, queues, customers in service, statistics,
+    pending events), the random module's state and the ID counters.
+    Compressed pickle, written to a temporary file first so a crash never
+    leaves half a checkpoint.
+    """
+    state = {
+        "simulation": simulation,
+        "random": random.getstate(),
+        "customers": CustomerStore.NUMBER_OF_CUSTOMERS,
+        }
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "wb") as checkpointFile:
+        checkpointFile.write(data)
+    os.rename(temporaryPath, path)
+
+def loadCheckpoint(path, seed = None):
+    """
+    The EventSimulation saved at path, ready for run(). By default the
+    random state is put back too, so the run carries on exactly as if it
+    had never stopped. Passing a seed starts a new random stream instead,
+    for forking several what-if continuations (possibly after changing
+    stations) from one warmed-up checkpoint.
+    """
+    with open(path, "rb") as checkpointFile:
+        state = pickle.loads(zlib.decompress(checkpointFile.read()))
+    CustomerStore.NUMBER_OF_CUSTOMERS = state["customers"]
+    if seed is None:
+        random.setstate(state["random"])
+    else:
+        random.seed(seed)
+    return state["simulation"]
+
+def isTandemShop(shop):
+    #a serial chain of FIFO stations: no stage has parallel stations
+    return all(len(station) == 1 for station in shop.stations)
+
+def runTandemShop(tandem, shop, arrivalTimes, rng):
+    """
+    Simulate a tandem shop with array recursions and fill in its totals as
+    the event engine would. Returns the time of the last exit, or None,
+    leaving the shop untouched, if the shop's mean waiting time would have
+    reached MAX_ACCEPTABLE_QUEUE_LENGTH and turned customers away, since
+    that feedback can't be expressed as an array recursion.
+    """
+    stations = [(station[0].serviceRate, station[0].numberOfServers,
+            station[0].probabilityOfUse) for station in shop.stations]
+    stages = []
+    exitTimes, waiting, served = tandem.simulateTandem(arrivalTimes, stations,
+            rng, stages)
+    #mean waiting time of everyone who had left by each arrival
+    order = tandem.np.argsort(exitTimes, kind = "mergesort")
+    exitedBy = tandem.np.searchsorted(exitTimes[order], arrivalTimes,
+            side = "right")
+    totalWaiting = tandem.np.concatenate(([0.0],
+            tandem.np.cumsum(waiting[order])))
+    meanWaiting = tandem.np.where(exitedBy > 0, totalWaiting[exitedBy] /
+            tandem.np.maximum(exitedBy, 1), 1.0)
+    if (meanWaiting >= MAX_ACCEPTABLE_QUEUE_LENGTH).any():
+        return None
+    finished = exitTimes <= ABORT_SIMULATION_TIME
+    shop.total_number_of_customers += int(finished.sum())
+    shop.total_time_spent_waiting += float(waiting[finished].sum())
+    shop.total_time_spent_being_served += float(served[finished].sum())
+    shop.waitingStats.addArray(waiting[finished])
+    shop.timeInSystemStats.addArray((exitTimes - arrivalTimes)[finished])
+    #the levels the event engine would have closed at its last event
+    endTime = min(float(exitTimes.max()), ABORT_SIMULATION_TIME)
+    addLevelHistory(shop.customersInShopStats, tandem, arrivalTimes,
+            exitTimes, endTime)
+    for station, (stageArrivals, starts) in zip(shop.stations, stages):
+        started = starts <= endTime
+        station[0].waitingStats.addArray((starts - stageArrivals)[started])
+        waited = starts > stageArrivals
+        addLevelHistory(station[0].waitingLineStats, tandem,
+                stageArrivals[waited], starts[waited], endTime)
+    return endTime
+
+def addLevelHistory(stats, tandem, upTimes, downTimes, endTime):
+    #fill a TimeWeightedStats from the times its level went up and down
+    area, maximum = tandem.levelHistory(upTimes, downTimes, endTime)
+    stats.merge(streamstats.TimeWeightedStats.fromDict({"area": area,
+        "elapsed": endTime, "maximum": maximum}))
+    stats.lastTime = endTime
 
-#create customers arrival diffs:
-CUSTOMERS = [round(random.expovariate(AVERAGE_ARRIVAL_RATE)) for tick in 
-        xrange(NUMBER_OF_CUSTOMERS_TO_SIMULATE - 1)]
+def runFastSimulation(shops, arrivalTimes):
+    #Like runEventSimulation, but serial chains of stations are simulated
+    #with NumPy arrays. Falls back to the event engine for shops with
+    #parallel stations, for shops that would turn customers away, and for
+    #everything when NumPy is missing. Only the array path holds all the
+    #arrival times; the event engine replays a copy of an ArrivalProcess
+    #(which needs its own rng to see the same customers).
+    try:
+        import tandem
+    except ImportError:
+        return runEventSimulation(shops, arrivalTimes)
+    if isinstance(arrivalTimes, arrivals.ArrivalProcess):
+        eventArrivals = copy.deepcopy(arrivalTimes)
+        times = tandem.np.fromiter(arrivalTimes, dtype = float)
+    else:
+        eventArrivals = arrivalTimes
+        times = tandem.np.array(arrivalTimes, dtype = float)
+    rng = tandem.np.random.RandomState(random.getrandbits(32))
+    endTimes = []
+    eventShops = []
+    for shop in shops:
+        endTime = None
+        if isTandemShop(shop):
+            endTime = runTandemShop(tandem, shop, times, rng)
+        if endTime is None:
+            eventShops.append(shop)
+        else:
+            endTimes.append(endTime)
+    if eventShops:
+        endTimes.append(runEventSimulation(eventShops, eventArrivals))
+    #the last exit from any shop, as the event engine would return
+    return max(endTimes) if endTimes else 0
+
+#Two-sided 95% Student t quantiles for 1..30 degrees of freedom; beyond
+#that the normal quantile is close enough
+T_QUANTILES_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+        2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+        2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048,
+        2.045, 2.042]
+Z_QUANTILE_95 = 1.960
+
+def meanWithConfidenceInterval(values):
+    #(mean, half width of the 95% confidence interval) of independent values
+    count = len(values)
+    mean = float(sum(values)) / count
+    if (count < 2):
+        return mean, float("inf")
+    variance = sum((value - mean) ** 2 for value in values) / (count - 1)
+    if (count - 1 <= len(T_QUANTILES_95)):
+        quantile = T_QUANTILES_95[count - 2]
+    else:
+        quantile = Z_QUANTILE_95
+    return mean, quantile * math.sqrt(variance / count)
+
+def replicationSeeds(masterSeed, replications):
+    #one seed per replication, all derived from the master seed, so a run
+    #is reproducible no matter how replications are spread over processes
+    master = random.Random(masterSeed)
+    return [master.getrandbits(64) for replication in xrange(replications)]
+
+def runSeededSimulation(shops, seed, numberOfCustomers,
+        arrivalRate = AVERAGE_ARRIVAL_RATE):
+    #one independent run in its own RNG stream, as per shop result tuples
+    random.seed(seed)
+    runEventSimulation(shops, poissonArrivals(numberOfCustomers, arrivalRate))
+    return [(shop.shopName, shop.getMeanAverageWaitingTime(),
+            shop.getMeanAverageServiceTime(), shop.total_number_of_customers,
+            shop.getStreamingStats())
+            for shop in shops]
+
+def runReplication(task):
+    #module level so a process pool can pickle it
+    shopFactory, seed, numberOfCustomers = task
+    return runSeededSimulation(shopFactory(), seed, numberOfCustomers)
 
-#Take the arrival rate values and add them to create arrival times:
-for index, i in enumerate(CUSTOMERS):
-    if (index == 0):
-        CUSTOMERS[index] = 0
+def runReplications(shopFactory, replications, masterSeed = 0, workers = None,
+        numberOfCustomers = NUMBER_OF_CUSTOMERS_TO_SIMULATE):
+    """
+    Run independent replications of the shops built by shopFactory (a
+    module level function, so it can be sent to worker processes) across a
+    process pool of workers processes (default: one per CPU), and merge the
+    per shop results into means with 95% confidence intervals.
+    """
+    tasks = [(shopFactory, seed, numberOfCustomers)
+            for seed in replicationSeeds(masterSeed, replications)]
+    if (workers == 1):
+        results = map(runReplication, tasks)
     else:
-        CUSTOMERS[index] = CUSTOMERS[index-1] + i
-
-CUSTOMERS.sort()
-
-currentTick = 0
-
-while True:
-    #TODO refactor into several functions
-    if ((currentTick  % 1000) == 0):
-        logging.info("TickNumber %d ", currentTick)
-        #print "TickNumber", currentTick
-        for shop in SHOPS:
-            logging.info("Shop Stats %s", shop.getStats())
-            logging.debug(shop.getAllQueueStrings())
-
-    if ((currentTick == ABORT_SIMULATION_TIME) or
-            ((CUSTOMERS[0] < currentTick) and \
-                    not(any(shop.areCustomersInStore() for shop in SHOPS)))):
-        #simulation over, we have looped, there are no customers in any store
-        break
-
-    while (CUSTOMERS[0] == currentTick):
-        arrivalTime = CUSTOMERS.pop(0)
-        #Customer goes to the shops!
-        for shop in SHOPS:
-            #We try go to all the shops!
-            if (shop.getMeanAverageWaitingTime() < MAX_ACCEPTABLE_QUEUE_LENGTH):
-                newCustomer = Customer(arrivalTime)
-                shop.addCustomer(newCustomer, currentTick)
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(runReplication, tasks, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    return summarizeReplications(results)
+
+def mergeStreamingStats(statsDicts):
+    #pool Shop.getStreamingStats() results from runs of the same shop
+    waiting = streamstats.DistributionStats()
+    timeInSystem = streamstats.DistributionStats()
+    customersInShop = streamstats.TimeWeightedStats()
+    for stats in statsDicts:
+        waiting.merge(streamstats.DistributionStats.fromDict(
+            stats["waitingTime"]))
+        timeInSystem.merge(streamstats.DistributionStats.fromDict(
+            stats["timeInSystem"]))
+        customersInShop.merge(streamstats.TimeWeightedStats.fromDict(
+            stats["customersInShop"]))
+    return waiting, timeInSystem, customersInShop
+
+def summarizeReplications(results):
+    #results holds one list of per shop tuples for each replication
+    summaries = []
+    for shopResults in zip(*results):
+        waiting = meanWithConfidenceInterval([r[1] for r in shopResults])
+        service = meanWithConfidenceInterval([r[2] for r in shopResults])
+        served = meanWithConfidenceInterval([r[3] for r in shopResults])
+        summary = {
+            "shopName": shopResults[0][0],
+            "replications": len(shopResults),
+            "meanWaitingTime": waiting,
+            "meanServiceTime": service,
+            "customersServed": served,
+            }
+        #results cached before streaming statistics only have four fields
+        if all(len(r) > 4 for r in shopResults):
+            waitingStats, timeInSystemStats, customersInShopStats = \
+                    mergeStreamingStats([r[4] for r in shopResults])
+            summary["waitingTimeQuantiles"] = (waitingStats.quantile(0.95),
+                    waitingStats.quantile(0.99))
+            summary["timeInSystemQuantiles"] = (
+                    timeInSystemStats.quantile(0.95),
+                    timeInSystemStats.quantile(0.99))
+            summary["customersInShop"] = (customersInShopStats.mean(),
+                    customersInShopStats.maximum)
+        summaries.append(summary)
+    return summaries
+
+def getReplicationStats(summary):
+    stats = """
+    ShopName: %s
+    Replications: %d
+    Mean Average Waiting Time: %f +/- %f
+    Mean Average Service Time: %f +/- %f
+    Customers Served: %f +/- %f""" % ((summary["shopName"],
+            summary["replications"]) + summary["meanWaitingTime"] +
+            summary["meanServiceTime"] + summary["customersServed"])
+    if ("waitingTimeQuantiles" in summary):
+        stats += """
+    95th/99th Percentile Waiting Time: %f / %f
+    95th/99th Percentile Time In Shop: %f / %f
+    Mean/Max Customers In Shop: %f / %d""" % (
+            summary["waitingTimeQuantiles"] +
+            summary["timeInSystemQuantiles"] + summary["customersInShop"])
+    return stats
+
+#An adaptive run stops a shop once the 95% confidence interval of its mean
+#waiting time, warm-up deleted, is within RELATIVE_PRECISION of the mean.
+#Shops are checked every CHECK_INTERVAL of simulated time.
+RELATIVE_PRECISION = 0.05
+NUMBER_OF_BATCHES = 20
+CHECK_INTERVAL = 10 * REPORT_INTERVAL
+
+def estimateSteadyState(shop):
+    #(warm-up customers, (mean, half width)) of the shop's waiting time
+    #after MSER-5 deletion by batch means, None if there is too little data
+    steadyState = shop.steadyStateMonitor.steadyStateBatchMeans(
+            NUMBER_OF_BATCHES)
+    if steadyState is None:
+        return None
+    warmup, batchMeans = steadyState
+    return warmup, meanWithConfidenceInterval(batchMeans)
+
+def runAdaptiveSimulation(shops, arrivalProcess,
+        relativePrecision = RELATIVE_PRECISION,
+        checkInterval = CHECK_INTERVAL, continuousTime = True):
+    """
+    Instead of a fixed number of customers, run each shop until its mean
+    waiting time is known to relativePrecision, or ABORT_SIMULATION_TIME.
+    Each shop runs in its own EventSimulation on its own copy of
+    arrivalProcess (a list or an arrivals.ArrivalProcess; give a random
+    process its own rng for every shop to see the same customers), so
+    shops that have converged stop while the others carry on. A shop whose
+    mean waiting time has reached MAX_ACCEPTABLE_QUEUE_LENGTH turns every
+    later customer away and can't converge, so it stops as saturated once
+    it is empty. Returns one dict per shop.
+    """
+    runs = []
+    for shop in shops:
+        shop.steadyStateMonitor = streamstats.SteadyStateMonitor()
+        if isinstance(arrivalProcess, arrivals.ArrivalProcess):
+            shopArrivals = copy.deepcopy(arrivalProcess)
+        else:
+            shopArrivals = arrivals.SequenceArrivals(arrivalProcess)
+        runs.append(EventSimulation([shop], shopArrivals, continuousTime))
+
+    results = {}
+    active = runs
+    sliceEnd = 0
+    while active:
+        sliceEnd = min(sliceEnd + checkInterval, ABORT_SIMULATION_TIME)
+        stillRunning = []
+        for run in active:
+            run.run(sliceEnd)
+            shop = run.shops[0]
+            steadyState = estimateSteadyState(shop)
+            converged = ((steadyState is not None) and
+                    (steadyState[1][1] <= relativePrecision *
+                        abs(steadyState[1][0])))
+            saturated = ((shop.getMeanAverageWaitingTime() >=
+                    MAX_ACCEPTABLE_QUEUE_LENGTH) and
+                    (not shop.areCustomersInStore()))
+            if (converged or saturated or (not run.calendar.events) or
+                    (sliceEnd >= ABORT_SIMULATION_TIME)):
+                results[shop] = {
+                    "shopName": shop.shopName,
+                    "converged": converged,
+                    "saturated": saturated,
+                    "endTime": run.finish(),
+                    "customersServed": shop.total_number_of_customers,
+                    "warmupCustomers": steadyState[0] if steadyState else 0,
+                    #the plain mean if warm-up couldn't be found
+                    "meanWaitingTime": steadyState[1] if steadyState else
+                        (shop.getMeanAverageWaitingTime(), float("inf")),
+                    }
+                logging.info("Shop %s stopped at %d, converged: %s, "
+                        "saturated: %s", shop.shopName,
+                        results[shop]["endTime"], converged, saturated)
             else:
-                logging.info("Line too long at %s. AverageWaitingTime: %d " +
-                        "current time %d ",
-                        shop.shopName, shop.getMeanAverageWaitingTime(),
-                        currentTick)
-        CUSTOMERS.append(arrivalTime)
-
-    for shop in SHOPS:
-        shop.tickOfTime(currentTick)
-    #no more of the same arrival time.
-    currentTick += 1
-
-print "Simulation over."
-print "Ticks:", currentTick
-print "Customers:,", NUMBER_OF_CUSTOMERS_TO_SIMULATE
-print "Statistics:"
-logging.info("Simulation over.\nTickNumber %d\nStatistics: ", currentTick)
-for shop in SHOPS:
-    print shop.getStats()
-    logging.info("Shop Stats %s", shop.getStats())
-    logging.info("-----")
\ No newline at end of file
+                stillRunning.append(run)
+        active = stillRunning
+    return map(results.get, shops)
+
+def getAdaptiveStats(result):
+    return """
+    ShopName: %s
+    Converged: %s
+    Saturated: %s
+    Stopped At: %f
+    Customers Served: %d
+    Warm-up Customers Deleted: %d
+    Mean Average Waiting Time: %f +/- %f""" % ((result["shopName"],
+            result["converged"], result["saturated"], result["endTime"],
+            result["customersServed"], result["warmupCustomers"]) +
+            tuple(result["meanWaitingTime"]))
+
+#Parameters a sweep grid can vary: "arrivalRate", or
+#"<station description>.<one of these>" for every station with that
+#description in the swept shop
+SWEEP_STATION_PARAMETERS = ("serviceRate", "meanServiceTime",
+        "numberOfServers", "probabilityOfUse", "copies")
+
+def applySweepCell(shopConfig, cell):
+    #copy of shopConfig with the cell's station parameters overridden
+    shopConfig = json.loads(json.dumps(shopConfig))
+    for name, value in cell.items():
+        if (name == "arrivalRate"):
+            continue
+        description, _, parameter = name.rpartition(".")
+        if (parameter not in SWEEP_STATION_PARAMETERS):
+            raise ValueError("Can't sweep over %s" % name)
+        stations = [station for stage in shopConfig["stages"]
+                for station in stage if station["description"] == description]
+        if not stations:
+            raise ValueError("%s has no station %r" %
+                    (shopConfig["name"], description))
+        for station in stations:
+            #the two ways of giving the service rate replace each other
+            if (parameter in ("serviceRate", "meanServiceTime")):
+                station.pop("serviceRate", None)
+                station.pop("meanServiceTime", None)
+            station[parameter] = value
+    return shopConfig
+
+def expandSweep(sweep, shopConfigs):
+    #one job for every replication of every cell of the grid
+    matches = [config for config in shopConfigs
+            if config["name"] == sweep["shop"]]
+    if not matches:
+        raise ValueError("Sweep shop %r is not one of %s" % (sweep["shop"],
+            ", ".join(config["name"] for config in shopConfigs)))
+    shopConfig = matches[0]
+    grid = sweep.get("grid", {})
+    names = sorted(grid)
+    seeds = replicationSeeds(sweep.get("masterSeed", 0),
+            sweep.get("replications", 1))
+    jobs = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        cell = dict(zip(names, values))
+        config = applySweepCell(shopConfig, cell)
+        for seed in seeds:
+            jobs.append({
+                "cell": cell,
+                "shop": config,
+                "arrivalRate": cell.get("arrivalRate", AVERAGE_ARRIVAL_RATE),
+                "seed": seed,
+                "numberOfCustomers": sweep.get("numberOfCustomers",
+                    NUMBER_OF_CUSTOMERS_TO_SIMULATE),
+                })
+    return jobs
+
+def sweepJobKey(job):
+    #content address of a job: everything that determines its result
+    inputs = dict((name, job[name]) for name in
+            ("shop", "arrivalRate", "seed", "numberOfCustomers"))
+    return hashlib.sha1(json.dumps(inputs, sort_keys = True)).hexdigest()
+
+def runSweepJob(job):
+    return sweepJobKey(job), runSeededSimulation([buildShop(job["shop"])],
+            job["seed"], job["numberOfCustomers"], job["arrivalRate"])
+
+def runSweep(sweep, shopConfigs, cacheDir, workers = None):
+    """
+    Run every cell of a sweep and return [(cell, summary), ...] in grid
+    order. Each replication's result is stored in cacheDir under the hash
+    of its inputs, so only jobs whose parameters or seed changed since an
+    earlier run get simulated.
+    """
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    jobs = expandSweep(sweep, shopConfigs)
+    cachePath = lambda key: os.path.join(cacheDir, key + ".json")
+    missing = dict((sweepJobKey(job), job) for job in jobs
+            if not os.path.exists(cachePath(sweepJobKey(job))))
+    logging.info("Sweep: %d jobs, %d cached", len(jobs),
+            len(jobs) - len(missing))
+    if missing:
+        pool = multiprocessing.Pool(workers)
+        try:
+            #written as they finish, so an interrupted sweep keeps its work
+            for key, result in pool.imap_unordered(runSweepJob,
+                    missing.values()):
+                with open(cachePath(key), "w") as resultFile:
+                    json.dump(result, resultFile)
+        finally:
+            pool.close()
+            pool.join()
+    cells = collections.OrderedDict()
+    for job in jobs:
+        with open(cachePath(sweepJobKey(job))) as resultFile:
+            result = json.load(resultFile)
+        cellKey = json.dumps(job["cell"], sort_keys = True)
+        cells.setdefault(cellKey, (job["cell"], []))[1].append(result)
+    return [(cell, summarizeReplications(results)[0])
+            for cell, results in cells.values()]
+
+def runSweepFile(path, workers = None):
+    #a sweep file names the shop to vary, the grid, and optionally
+    #"shops" (config file), "cacheDir", "replications", "masterSeed" and
+    #"numberOfCustomers"; relative paths are from the sweep file
+    with open(path) as sweepFile:
+        sweep = json.load(sweepFile)
+    directory = os.path.dirname(os.path.abspath(path))
+    shopConfigs = loadShopConfigs(os.path.join(directory,
+            sweep.get("shops", SHOPS_CONFIG)))
+    cacheDir = os.path.join(directory, sweep.get("cacheDir", "sweep-cache"))
+    return runSweep(sweep, shopConfigs, cacheDir, workers)
+
+def main():
+    #queues-sim.py [sweep.json | --trace trace.bin | --adaptive]
+    if ((len(sys.argv) > 1) and (sys.argv[1] == "--adaptive")):
+        #the same endless stream of customers for every shop
+        arrivalProcess = arrivals.PoissonArrivals(AVERAGE_ARRIVAL_RATE,
+                rng = random.Random(random.getrandbits(64)))
+        for result in runAdaptiveSimulation(buildShops(), arrivalProcess):
+            print getAdaptiveStats(result)
+        return
+
+    if ((len(sys.argv) > 1) and (sys.argv[1] != "--trace")):
+        for cell, summary in runSweepFile(sys.argv[1]):
+            print json.dumps(cell, sort_keys = True)
+            print getReplicationStats(summary)
+        return
+
+    shops = buildShops()
+    arrivalProcess = poissonArrivals(NUMBER_OF_CUSTOMERS_TO_SIMULATE)
+    if (len(sys.argv) > 2):
+        #the array path has no per customer events, so trace everything
+        #through the event engine
+        startTracing(shops, sys.argv[2])
+        try:
+            endTime = runEventSimulation(shops, arrivalProcess)
+        finally:
+            stopTracing()
+    else:
+        endTime = runFastSimulation(shops, arrivalProcess)
+
+    print "Simulation over."
+    print "Ticks:", endTime
+    print "Customers:,", NUMBER_OF_CUSTOMERS_TO_SIMULATE
+    print "Statistics:"
+    logging.info("Simulation over.\nTickNumber %d\nStatistics: ", endTime)
+    for shop in shops:
+        print shop.getStats()
+        print shop.getStationStats()
+        logging.info("Shop Stats %s", shop.getStats())
+        logging.info("-----")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
-import math
 import operator
+import heapq
+
+try:
+    import numpy as np
+except ImportError:
+    np = None #only the array functions and JacksonNetwork need it
 
 
 '''Source: https://gist.githubusercontent.com/gbigwood/5304126/raw/fa64a8299e653bcbc5d056d9d49f2a16ec6a310f/queues-theory.py'''
@@ -20,22 +25,15 @@ class WorkStation(object):
         self.utilisation = self.computeUtilisation()
         pass
 
-    def findIValue(self, i):
-        i = float(i)
-        singleNodeUtilisation = (self.numberOfServers *
-                (self.arrivalRate * self.serviceRate))
-        return ((singleNodeUtilisation ** i) / math.factorial(i))
-
     def possionRatioFunction(self):
-        #This could be more efficient if using one loop. Left as is for clarity
-        numerator = sum(self.findIValue(i)
-                for i in xrange(int(self.numberOfServers) - 1))
-        demonimator = sum(self.findIValue(i)
-                for i in xrange(int(self.numberOfServers)))
-        self.poissonRatio = numerator/demonimator
+        #The share of the Poisson weights a**i/i! (a = arrivalRate/serviceRate)
+        #that falls below numberOfServers, i.e. 1 - Erlang B
+        self.poissonRatio = 1.0 - erlangB(self.arrivalRate / self.serviceRate,
+                int(self.numberOfServers))
         return self.poissonRatio
 
     def computeProbabilityOfMultipleServersBeingBusy(self):
+        #Erlang C, the chance an arrival finds every server busy
         self.possionRatioFunction()
         self.probabilityOfMultipleServersBeingBusy  = \
                 ((1- self.poissonRatio) /
@@ -46,7 +44,7 @@ class WorkStation(object):
         assert self.numberOfServers >= 1, "No servers"
         self.utilisation = (self.arrivalRate /
                 (self.serviceRate*self.numberOfServers))
-        if (self.arrivalRate >= self.serviceRate):
+        if (self.utilisation >= 1.0):
             self.utilisation = 1.0
         assert ((self.utilisation >= 0) and (self.utilisation <= 1))
         return self.utilisation
@@ -89,6 +87,212 @@ class WorkStation(object):
         self.NJobsInTheSystem = (1 - self.utilisation) * (self.utilisation ** N)
         return self.NJobsInTheSystem
 
+def erlangB(offeredLoad, numberOfServers):
+    """
+    Probability that all numberOfServers servers are busy with no waiting
+    room, offeredLoad = arrival rate / service rate. Built up one server at
+    a time, B(k) = a B(k-1) / (k + a B(k-1)), which takes O(c) steps and
+    never forms a**c or c!, so it stays finite for thousands of servers.
+    """
+    blocking = 1.0
+    for k in xrange(1, numberOfServers + 1):
+        blocking = offeredLoad * blocking / (k + offeredLoad * blocking)
+    return blocking
+
+def erlangC(offeredLoad, numberOfServers):
+    """Probability of having to wait, from Erlang B"""
+    blocking = erlangB(offeredLoad, numberOfServers)
+    utilisation = offeredLoad / numberOfServers
+    return blocking / (1.0 - utilisation * (1.0 - blocking))
+
+def computeMultiServerMetrics(arrivalRates, serviceRates, numberOfServers):
+    """
+    Erlang C over whole NumPy arrays (broadcast together) of M/M/c
+    stations in one call. Returns arrays of (probability of waiting,
+    customers waiting to be served, time waiting); stations at or over
+    full utilisation get inf waits.
+    """
+    arrivalRates, serviceRates, numberOfServers = np.broadcast_arrays(
+            np.asarray(arrivalRates, dtype = float),
+            np.asarray(serviceRates, dtype = float),
+            np.asarray(numberOfServers, dtype = int))
+    offeredLoad = arrivalRates / serviceRates
+    blocking = np.ones(offeredLoad.shape)
+    #the same recurrence as erlangB, stopping at each station's own c
+    for k in xrange(1, int(numberOfServers.max()) + 1 if numberOfServers.size
+            else 1):
+        step = offeredLoad * blocking / (k + offeredLoad * blocking)
+        blocking = np.where(k <= numberOfServers, step, blocking)
+    utilisation = offeredLoad / numberOfServers
+    stable = utilisation < 1.0
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        probabilityOfWaiting = np.where(stable,
+                blocking / (1.0 - utilisation * (1.0 - blocking)), 1.0)
+        customersWaiting = np.where(stable,
+                probabilityOfWaiting * utilisation / (1.0 - utilisation),
+                np.inf)
+        timeWaiting = np.where(stable,
+                probabilityOfWaiting / (numberOfServers * serviceRates -
+                    arrivalRates), np.inf)
+    return probabilityOfWaiting, customersWaiting, timeWaiting
+
+def computeTimeWaiting(arrivalRate, serviceRate, numberOfServers):
+    #M/M/c waiting time, inf at or over full utilisation
+    if (arrivalRate >= serviceRate * numberOfServers):
+        return float("inf")
+    return (erlangC(arrivalRate / serviceRate, numberOfServers) /
+            (numberOfServers * serviceRate - arrivalRate))
+
+def findMinimumServers(arrivalRates, serviceRates, maxTimeWaiting = None,
+        maxProbabilityOfWaiting = None):
+    """
+    Fewest servers for each station (NumPy arrays, broadcast together) that
+    meets every target given. Waiting time and probability of waiting only
+    fall as servers are added, so the count is found by doubling past the
+    target and then bisecting, all stations at once.
+    """
+    if ((maxTimeWaiting is not None and maxTimeWaiting <= 0) or
+            (maxProbabilityOfWaiting is not None and
+                maxProbabilityOfWaiting <= 0)):
+        raise ValueError("Targets must be positive")
+    arrivalRates, serviceRates = np.broadcast_arrays(
+            np.asarray(arrivalRates, dtype = float),
+            np.asarray(serviceRates, dtype = float))
+
+    def meetsTargets(servers):
+        probabilityOfWaiting, customersWaiting, timeWaiting = \
+                computeMultiServerMetrics(arrivalRates, serviceRates, servers)
+        meets = np.ones(servers.shape, dtype = bool)
+        if maxTimeWaiting is not None:
+            meets &= timeWaiting <= maxTimeWaiting
+        if maxProbabilityOfWaiting is not None:
+            meets &= probabilityOfWaiting <= maxProbabilityOfWaiting
+        return meets
+
+    #at most floor(load) servers can't keep up: low always fails
+    low = np.floor(arrivalRates / serviceRates).astype(int)
+    high = low + 1
+    meets = meetsTargets(high)
+    while not meets.all():
+        low = np.where(meets, low, high)
+        high = np.where(meets, high, 2 * high)
+        meets = meetsTargets(high)
+    while (high - low > 1).any():
+        middle = np.where(high - low > 1, (low + high) // 2, high)
+        meets = meetsTargets(middle)
+        low = np.where(meets, low, middle)
+        high = np.where(meets, middle, high)
+    return high
+
+class JacksonNetwork(object):
+    """
+    An open network of M/M/c stations. Customers arrive from outside at
+    externalArrivalRates[i] per second, and on leaving station i go on to
+    station j with probability routing[i][j], leaving the network with
+    whatever probability is left over. Needs NumPy.
+    """
+
+    def __init__(self, serviceRates, numberOfServers, externalArrivalRates,
+            routing):
+        self.serviceRates = np.asarray(serviceRates, dtype = float)
+        self.numberOfServers = np.asarray(numberOfServers, dtype = int)
+        self.externalArrivalRates = np.asarray(externalArrivalRates,
+                dtype = float)
+        self.routing = np.asarray(routing, dtype = float)
+
+        #Compute the flow through every station
+        self.arrivalRates = self.computeArrivalRates()
+
+    def computeArrivalRates(self):
+        #traffic equations: lambda = external + routing^T lambda
+        identity = np.eye(len(self.serviceRates))
+        self.arrivalRates = np.linalg.solve(identity - self.routing.T,
+                self.externalArrivalRates)
+        return self.arrivalRates
+
+    def computeStationMetrics(self):
+        #(probability of waiting, customers waiting, time waiting per visit)
+        #for every station
+        (self.probabilityOfWaiting, self.customersWaitingToBeServed,
+                self.timeWaiting) = computeMultiServerMetrics(
+                        self.arrivalRates, self.serviceRates,
+                        self.numberOfServers)
+        return (self.probabilityOfWaiting, self.customersWaitingToBeServed,
+                self.timeWaiting)
+
+    def computeTotalTimeWaiting(self):
+        """
+        Mean time a customer spends waiting over their whole visit, by
+        Little's law: customers waiting anywhere / rate of arrivals
+        """
+        self.computeStationMetrics()
+        self.totalTimeWaiting = (self.customersWaitingToBeServed.sum() /
+                self.externalArrivalRates.sum())
+        return self.totalTimeWaiting
+
+    def computeTotalTimeInSystem(self):
+        self.computeStationMetrics()
+        customersInSystem = (self.customersWaitingToBeServed +
+                self.arrivalRates / self.serviceRates)
+        self.totalTimeInSystem = (customersInSystem.sum() /
+                self.externalArrivalRates.sum())
+        return self.totalTimeInSystem
+
+    def planCapacity(self, maxTimeWaiting = None,
+            maxProbabilityOfWaiting = None):
+        #fewest servers per station meeting per station targets
+        self.numberOfServers = findMinimumServers(self.arrivalRates,
+                self.serviceRates, maxTimeWaiting, maxProbabilityOfWaiting)
+        return self.numberOfServers
+
+    def planCapacityForTotalTimeWaiting(self, maxTotalTimeWaiting):
+        """
+        Fewest servers in total keeping computeTotalTimeWaiting within
+        maxTotalTimeWaiting. Starts every station at the least number of
+        servers that keeps up, then keeps adding a server wherever it cuts
+        the total wait the most. Waiting time is convex in the number of
+        servers, so this greedy choice is optimal.
+        """
+        if (maxTotalTimeWaiting <= 0):
+            raise ValueError("Targets must be positive")
+        totalArrivalRate = self.externalArrivalRates.sum()
+        arrivalRates = self.arrivalRates.tolist()
+        serviceRates = self.serviceRates.tolist()
+        servers = (np.floor(self.arrivalRates / self.serviceRates)
+                .astype(int) + 1).tolist()
+        waiting = [computeTimeWaiting(arrivalRates[i], serviceRates[i],
+            servers[i]) for i in xrange(len(servers))]
+        total = sum(arrivalRates[i] * waiting[i]
+                for i in xrange(len(servers))) / totalArrivalRate
+
+        def nextServer(i):
+            #cut in total waiting from one more server at station i
+            fewerWaiting = computeTimeWaiting(arrivalRates[i],
+                    serviceRates[i], servers[i] + 1)
+            return (-arrivalRates[i] * (waiting[i] - fewerWaiting) /
+                    totalArrivalRate, i, fewerWaiting)
+
+        candidates = [nextServer(i) for i in xrange(len(servers))]
+        heapq.heapify(candidates)
+        while (total > maxTotalTimeWaiting):
+            change, i, fewerWaiting = heapq.heappop(candidates)
+            servers[i] += 1
+            waiting[i] = fewerWaiting
+            total += change
+            heapq.heappush(candidates, nextServer(i))
+        self.numberOfServers = np.array(servers)
+        return self.numberOfServers
+
+def printNetworkStatistics(nameOfRestaurant, network):
+    """Print end to end statistics for a JacksonNetwork"""
+    print nameOfRestaurant, "station arrival rates:", network.arrivalRates
+    print nameOfRestaurant, "waiting time:", network.computeTotalTimeWaiting()
+    print nameOfRestaurant, "total time in system:",
+    print network.computeTotalTimeInSystem()
+    print nameOfRestaurant, "customers waiting to be served:",
+    print network.customersWaitingToBeServed.sum()
+    print "--------"
+
 def printStatistics(nameOfRestaurant, listOfWorkStations):
     """Print statistics for a given shop and workStations"""
     #nameOfRestaurant = '{:<12}'.format(nameOfRestaurant)
@@ -125,13 +329,31 @@ def printStatistics(nameOfRestaurant, listOfWorkStations):
 #In people per second:
 ARRIVAL_RATE = 0.005
 
-#A basic counter with one station and an infinite queue:
-basicCounter = WorkStation(arrivalRate = 0.25, serviceRate = 0.5)
-print "Basic queue waiting time:", basicCounter.computeTimeWaiting()
-print "Basic queue time in system: ", basicCounter.computeTimeInSystem()
-print "--------"
-
+def main():
+    #A basic counter with one station and an infinite queue:
+    basicCounter = WorkStation(arrivalRate = 0.25, serviceRate = 0.5)
+    print "Basic queue waiting time:", basicCounter.computeTimeWaiting()
+    print "Basic queue time in system: ", basicCounter.computeTimeInSystem()
+    print "--------"
 
+    if np is not None:
+        #Subway as a network: 80% of customers go from meat + cheese to the
+        #toaster, the rest straight to salad + dressing
+        subwayNetwork = JacksonNetwork(
+                serviceRates = [1/8.0, 1/17.0, 1/32.0, 1/17.0, 1/15.0],
+                numberOfServers = [1, 1, 1, 1, 1],
+                externalArrivalRates = [ARRIVAL_RATE, 0, 0, 0, 0],
+                routing = [[0, 1.0, 0, 0, 0],
+                    [0, 0, 0.8, 0.2, 0],
+                    [0, 0, 0, 1.0, 0],
+                    [0, 0, 0, 0, 1.0],
+                    [0, 0, 0, 0, 0]])
+        printNetworkStatistics("Subway network", subwayNetwork)
+        print "Subway servers for at most 10s waiting in total:",
+        print subwayNetwork.planCapacityForTotalTimeWaiting(10.0)
+        print "Subway servers for at most 5% chance of waiting anywhere:",
+        print subwayNetwork.planCapacity(maxProbabilityOfWaiting = 0.05)
+        print "--------"
 
 
 
@@ -196,4 +418,7 @@ choptStations = [
         WorkStation(arrivalRate = ARRIVAL_RATE,
             serviceRate = 1/17.0, numberOfServers = 3.0), #paying + wrapping
         ]
-printStatistics("Chopt", choptStations)'''
\ No newline at end of file
+printStatistics("Chopt", choptStations)'''
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+import array
+import math
+
+'''
+Constant memory statistics for quantities observed one value at a time,
+such as waiting times and queue lengths. The accumulators can merge with
+another instance of themselves, so replications run in separate processes
+can be combined without their raw values, and convert to and from a plain
+dict for JSON. SteadyStateMonitor finds the warm-up of a single run
+instead.
+'''
+
+class RunningStats(object):
+    """Count, mean, variance and maximum by Welford's update"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sumOfSquares = 0.0 #of differences from the mean
+        self.maximum = float("-inf")
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sumOfSquares += delta * (value - self.mean)
+        if (value > self.maximum):
+            self.maximum = value
+
+    def merge(self, other):
+        #Chan et al.'s pairwise combination of two partial results
+        count = self.count + other.count
+        if (count == 0):
+            return
+        delta = other.mean - self.mean
+        self.sumOfSquares += (other.sumOfSquares +
+                delta * delta * self.count * other.count / count)
+        self.mean += delta * other.count / count
+        self.count = count
+        self.maximum = max(self.maximum, other.maximum)
+
+    def variance(self):
+        if (self.count < 2):
+            return 0.0
+        return self.sumOfSquares / (self.count - 1)
+
+    def toDict(self):
+        return {"count": self.count, "mean": self.mean,
+                "sumOfSquares": self.sumOfSquares,
+                "maximum": self.maximum if self.count else None}
+
+    @classmethod
+    def fromDict(cls, values):
+        stats = cls()
+        stats.count = values["count"]
+        stats.mean = values["mean"]
+        stats.sumOfSquares = values["sumOfSquares"]
+        if (values["maximum"] is not None):
+            stats.maximum = values["maximum"]
+        return stats
+
+class QuantileSketch(object):
+    """
+    DDSketch: positive values are counted in buckets whose bounds grow by a
+    factor gamma = (1 + a) / (1 - a), so any quantile comes back within
+    relative error a. Values up to MIN_VALUE count as zero. Past maxBuckets
+    the lowest buckets are folded together, which only costs accuracy at
+    the low end.
+    """
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relativeAccuracy = 0.01, maxBuckets = 2048):
+        self.relativeAccuracy = relativeAccuracy
+        self.maxBuckets = maxBuckets
+        self.gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.logGamma = math.log(self.gamma)
+        self.buckets = {} #bucket index: count
+        self.zeroCount = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if (value <= QuantileSketch.MIN_VALUE):
+            self.zeroCount += 1
+            return
+        key = int(math.ceil(math.log(value) / self.logGamma))
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        if (len(self.buckets) > self.maxBuckets):
+            self.collapse()
+
+    def collapse(self):
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.maxBuckets
+        if (excess <= 0):
+            return
+        folded = sum(self.buckets.pop(key) for key in keys[:excess])
+        self.buckets[keys[excess]] += folded
+
+    def merge(self, other):
+        if (other.gamma != self.gamma):
+            raise ValueError("Can't merge sketches of different accuracy")
+        for key, count in other.buckets.iteritems():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zeroCount += other.zeroCount
+        self.count += other.count
+        self.collapse()
+
+    def quantile(self, q):
+        if (self.count == 0):
+            return float("nan")
+        rank = q * (self.count - 1)
+        if (rank < self.zeroCount):
+            return 0.0
+        seen = self.zeroCount
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if (seen > rank):
+                break
+        #middle of the bucket (gamma**(key-1), gamma**key] in relative terms
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def toDict(self):
+        return {"relativeAccuracy": self.relativeAccuracy,
+                "maxBuckets": self.maxBuckets,
+                "zeroCount": self.zeroCount,
+                #JSON object keys have to be strings
+                "buckets": dict((str(key), count)
+                    for key, count in self.buckets.iteritems())}
+
+    @classmethod
+    def fromDict(cls, values):
+        sketch = cls(values["relativeAccuracy"], values["maxBuckets"])
+        sketch.zeroCount = values["zeroCount"]
+        sketch.buckets = dict((int(key), count)
+                for key, count in values["buckets"].iteritems())
+        sketch.count = sketch.zeroCount + sum(sketch.buckets.itervalues())
+        return sketch
+
+class DistributionStats(object):
+    """Mean, variance and quantiles of one quantity"""
+
+    def __init__(self, relativeAccuracy = 0.01):
+        self.moments = RunningStats()
+        self.sketch = QuantileSketch(relativeAccuracy)
+
+    def add(self, value):
+        #RunningStats.add and QuantileSketch.add inlined, this is called
+        #for every customer at every station
+        moments = self.moments
+        moments.count += 1
+        delta = value - moments.mean
+        moments.mean += delta / moments.count
+        moments.sumOfSquares += delta * (value - moments.mean)
+        if (value > moments.maximum):
+            moments.maximum = value
+        sketch = self.sketch
+        sketch.count += 1
+        if (value <= QuantileSketch.MIN_VALUE):
+            sketch.zeroCount += 1
+            return
+        key = int(math.ceil(math.log(value) / sketch.logGamma))
+        buckets = sketch.buckets
+        buckets[key] = buckets.get(key, 0) + 1
+        if (len(buckets) > sketch.maxBuckets):
+            sketch.collapse()
+
+    def addMany(self, values):
+        for value in values:
+            self.add(value)
+
+    def addArray(self, values):
+        #addMany for a NumPy array, with array operations instead of a loop:
+        #the moments are merged in as one partial result, the bucket keys
+        #counted with np.unique
+        import numpy as np
+        values = np.asarray(values, dtype = float)
+        if not len(values):
+            return
+        part = RunningStats()
+        part.count = len(values)
+        part.mean = float(values.mean())
+        part.sumOfSquares = float(np.square(values - part.mean).sum())
+        part.maximum = float(values.max())
+        self.moments.merge(part)
+        sketch = self.sketch
+        positive = values[values > QuantileSketch.MIN_VALUE]
+        sketch.count += len(values)
+        sketch.zeroCount += len(values) - len(positive)
+        keys, counts = np.unique(np.ceil(np.log(positive) /
+            sketch.logGamma).astype(np.int64), return_counts = True)
+        buckets = sketch.buckets
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+        if (len(buckets) > sketch.maxBuckets):
+            sketch.collapse()
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def count(self):
+        return self.moments.count
+
+    def mean(self):
+        return self.moments.mean
+
+    def standardDeviation(self):
+        return math.sqrt(self.moments.variance())
+
+    def maximum(self):
+        return self.moments.maximum
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def toDict(self):
+        return {"moments": self.moments.toDict(),
+                "sketch": self.sketch.toDict()}
+
+    @classmethod
+    def fromDict(cls, values):
+        stats = cls()
+        stats.moments = RunningStats.fromDict(values["moments"])
+        stats.sketch = QuantileSketch.fromDict(values["sketch"])
+        return stats
+
+class TimeWeightedStats(object):
+    """
+    Time average and maximum of a level that changes in steps, such as a
+    queue length. update() is called with the new level every time it
+    changes; the level is assumed constant in between.
+    """
+
+    def __init__(self, startTime = 0):
+        self.level = 0
+        self.lastTime = startTime
+        self.area = 0.0 #integral of the level over elapsed
+        self.elapsed = 0.0
+        self.maximum = 0
+
+    def update(self, time, level):
+        self.area += self.level * (time - self.lastTime)
+        self.elapsed += time - self.lastTime
+        self.lastTime = time
+        self.level = level
+        if (level > self.maximum):
+            self.maximum = level
+
+    def close(self, time):
+        #count the current level up to time, e.g. at the end of a run
+        self.update(time, self.level)
+
+    def merge(self, other):
+        #pooled over both observation periods
+        self.area += other.area
+        self.elapsed += other.elapsed
+        self.maximum = max(self.maximum, other.maximum)
+
+    def mean(self):
+        if (self.elapsed == 0):
+            return float(self.level)
+        return self.area / self.elapsed
+
+    def toDict(self):
+        return {"area": self.area, "elapsed": self.elapsed,
+                "maximum": self.maximum}
+
+    @classmethod
+    def fromDict(cls, values):
+        stats = cls()
+        stats.area = values["area"]
+        stats.elapsed = values["elapsed"]
+        stats.maximum = values["maximum"]
+        return stats
+
+def mserTruncation(values):
+    """
+    MSER warm-up length: the number of leading values whose deletion
+    minimises the squared error of the rest, sum((x - mean)**2) / n**2.
+    Only the first half is considered for deletion; a result of
+    len(values) // 2 means the warm-up may not be over yet.
+    """
+    count = len(values)
+    tailSum = math.fsum(values)
+    tailSumOfSquares = math.fsum(value * value for value in values)
+    best, truncation = float("inf"), 0
+    for deleted in xrange(count // 2 + 1):
+        remaining = count - deleted
+        squaredError = tailSumOfSquares - tailSum * tailSum / remaining
+        if (squaredError / (remaining * remaining) < best):
+            best, truncation = squaredError / (remaining * remaining), deleted
+        value = values[deleted]
+        tailSum -= value
+        tailSumOfSquares -= value * value
+    return truncation
+
+class SteadyStateMonitor(object):
+    """
+    Keeps a series, such as each customer's waiting time, as means of
+    batchSize values, the form MSER-5 works on. Past maxBatches, neighbouring
+    batches are paired up so memory stays bounded on very long runs.
+    """
+
+    def __init__(self, batchSize = 5, maxBatches = 1 << 16):
+        self.batchSize = batchSize
+        self.maxBatches = maxBatches
+        self.batchMeans = array.array('d')
+        self.partialSum = 0.0
+        self.partialCount = 0
+
+    def add(self, value):
+        self.partialSum += value
+        self.partialCount += 1
+        if (self.partialCount == self.batchSize):
+            self.batchMeans.append(self.partialSum / self.batchSize)
+            self.partialSum = 0.0
+            self.partialCount = 0
+            if (len(self.batchMeans) > self.maxBatches):
+                self.batchMeans = array.array('d', [(self.batchMeans[i] +
+                    self.batchMeans[i + 1]) / 2 for i in
+                    xrange(0, len(self.batchMeans) - 1, 2)])
+                self.batchSize *= 2
+
+    def steadyStateBatchMeans(self, numberOfBatches = 20, minBatchLength = 10):
+        """
+        (values deleted as warm-up, numberOfBatches batch means of what is
+        left), or None while there is too little data after the warm-up or
+        MSER can't yet tell where the warm-up ends.
+        """
+        means = self.batchMeans
+        if (len(means) < 2 * numberOfBatches * minBatchLength):
+            return None
+        truncation = mserTruncation(means)
+        if (truncation == len(means) // 2):
+            return None
+        batchLength = (len(means) - truncation) // numberOfBatches
+        #any remainder is dropped from the start, next to the warm-up
+        start = len(means) - batchLength * numberOfBatches
+        batches = [math.fsum(means[i:i + batchLength]) / batchLength
+                for i in xrange(start, len(means), batchLength)]
+        return start * self.batchSize, batches
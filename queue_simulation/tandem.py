@@ -0,0 +1,89 @@
+import heapq
+
+import numpy as np
+
+'''
+Array based simulation of a serial chain of FIFO stations, for shops where
+every stage is a single WorkStation. Customers are pushed through one
+stage at a time: single server stages use the Lindley recursion in its
+closed form
+    D_n = C_n + max over k <= n of (A_k - C_(k-1)),  C_n = S_1 + ... + S_n
+(one cumulative max over the whole array), and multi server stages use the
+Kiefer-Wolfowitz recursion, where each customer takes the server that
+frees up first.
+'''
+
+def singleServerDepartures(arrivals, services):
+    #arrivals sorted; Lindley recursion without a Python loop
+    completed = np.cumsum(services)
+    before = completed - services
+    return completed + np.maximum.accumulate(arrivals - before)
+
+def multiServerDepartures(arrivals, services, numberOfServers):
+    #arrivals sorted; first come first served over numberOfServers servers
+    if (numberOfServers >= len(arrivals)):
+        return arrivals + services
+    departures = np.empty_like(arrivals)
+    freeAt = [0.0] * numberOfServers
+    heapreplace = heapq.heapreplace
+    for i, (arrival, service) in enumerate(zip(arrivals.tolist(),
+            services.tolist())):
+        departure = max(arrival, freeAt[0]) + service
+        heapreplace(freeAt, departure)
+        departures[i] = departure
+    return departures
+
+def simulateTandem(arrivalTimes, stations, rng, stages = None):
+    """
+    Push every customer through the stations in order. stations is a list
+    of (serviceRate, numberOfServers, probabilityOfUse) and rng a NumPy
+    RandomState. Returns (exitTimes, timeSpentWaiting, timeSpentBeingServed)
+    arrays indexed by customer. If stages is a list, the times customers
+    reached each station and started service there are appended to it as
+    one (arrivals, starts) pair per station.
+    """
+    #a copy: times is updated stage by stage and returned as the exit times
+    times = np.array(arrivalTimes, dtype = float)
+    count = len(times)
+    waiting = np.zeros(count)
+    served = np.zeros(count)
+    for serviceRate, numberOfServers, probabilityOfUse in stations:
+        if (probabilityOfUse < 1.0):
+            users = np.flatnonzero(rng.random_sample(count) <= probabilityOfUse)
+        else:
+            users = np.arange(count)
+        #customers reach this stage in the order they left the last one
+        users = users[np.argsort(times[users], kind = "mergesort")]
+        arrivals = times[users]
+        services = rng.exponential(1.0 / serviceRate, len(users))
+        if (int(numberOfServers) == 1):
+            departures = singleServerDepartures(arrivals, services)
+        else:
+            departures = multiServerDepartures(arrivals, services,
+                    int(numberOfServers))
+        starts = departures - services
+        waiting[users] += starts - arrivals
+        if stages is not None:
+            stages.append((arrivals, starts))
+        served[users] += services
+        times[users] = departures
+    return times, waiting, served
+
+def levelHistory(upTimes, downTimes, endTime):
+    """
+    (area, maximum) of a level that goes up by one at each of upTimes and
+    down by one at each of downTimes, from time 0 to endTime, e.g. the
+    number of customers in a shop from their arrival and exit times.
+    """
+    times = np.concatenate((upTimes, downTimes))
+    steps = np.concatenate((np.ones(len(upTimes)), -np.ones(len(downTimes))))
+    keep = times <= endTime
+    times, steps = times[keep], steps[keep]
+    if not len(times):
+        return 0.0, 0
+    #at equal times the level goes down first, so the maximum isn't inflated
+    order = np.lexsort((steps, times))
+    times = times[order]
+    levels = np.cumsum(steps[order])
+    durations = np.diff(np.append(times, endTime))
+    return float(np.dot(levels, durations)), max(int(levels.max()), 0)